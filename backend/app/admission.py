@@ -0,0 +1,248 @@
+# app/admission.py
+import os
+import time
+import math
+import heapq
+import asyncio
+import logging
+import functools
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# --- Configuration ---
+MAX_CONCURRENT_REQUESTS = int(os.getenv("MAX_CONCURRENT_REQUESTS", 4)) # /chat requests doing work at once
+MAX_QUEUE_DEPTH = int(os.getenv("MAX_QUEUE_DEPTH", 32)) # /chat requests allowed to wait for a slot
+MAX_QUEUE_WAIT_SECONDS = float(os.getenv("MAX_QUEUE_WAIT_SECONDS", 10)) # Give up waiting after this long
+SESSION_RATE_PER_MINUTE = float(os.getenv("SESSION_RATE_PER_MINUTE", 20))
+SESSION_BURST = int(os.getenv("SESSION_BURST", 5))
+IP_RATE_PER_MINUTE = float(os.getenv("IP_RATE_PER_MINUTE", 60))
+IP_BURST = int(os.getenv("IP_BURST", 20))
+# --- End Configuration ---
+
+# Queue priorities (lower is served first)
+PRIORITY_CONTINUING_SESSION = 0
+PRIORITY_NEW_SESSION = 1
+PRIORITY_BULK = 2 # /chat/bulk batches yield to interactive traffic
+
+WAIT_SAMPLES = 1000 # Recent queue waits / service times kept for the metrics
+MAX_TRACKED_KEYS = 10000 # Idle rate limit buckets are pruned beyond this
+
+
+class Rejected(Exception):
+    """Raised when a request is not admitted; carries the reason and a Retry-After hint in seconds."""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class TokenBucket:
+    """Classic token bucket: `capacity` tokens, refilled at `rate` tokens per second."""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, cost: float = 1) -> Tuple[bool, float]:
+        """Takes `cost` tokens. Returns (allowed, seconds until enough tokens are available)."""
+        self._refill(time.monotonic())
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return True, 0.0
+        return False, (cost - self.tokens) / self.rate if self.rate > 0 else 60.0
+
+    def is_full(self) -> bool:
+        self._refill(time.monotonic())
+        return self.tokens >= self.capacity
+
+
+class RateLimiter:
+    """Token buckets per key (session id, client IP, ...)."""
+
+    def __init__(self, name: str, rate_per_minute: float, burst: int):
+        self.name = name
+        self.rate = rate_per_minute / 60.0
+        self.burst = burst
+        self.buckets: Dict[Hashable, TokenBucket] = {}
+        self.rejected = 0
+
+    def check(self, key: Hashable, cost: float = 1):
+        """Consumes `cost` tokens (default one) for key or raises Rejected."""
+        if self.rate <= 0:
+            return
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            if len(self.buckets) >= MAX_TRACKED_KEYS:
+                self._prune()
+            bucket = self.buckets[key] = TokenBucket(self.rate, self.burst)
+        allowed, retry_after = bucket.take(cost)
+        if not allowed:
+            self.rejected += 1
+            raise Rejected(f"{self.name} rate limit exceeded", retry_after)
+
+    def _prune(self):
+        """Forgets buckets that have refilled completely; they behave like new ones anyway."""
+        for key in [key for key, bucket in self.buckets.items() if bucket.is_full()]:
+            del self.buckets[key]
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+class AdmissionController:
+    """
+    Bounds concurrent work and queues the overflow by priority. Requests beyond the queue depth,
+    or that wait longer than the queue timeout, are rejected fast with a Retry-After estimate.
+    Must be used from the event loop only (no locking needed).
+    """
+
+    def __init__(self, max_concurrent: int = MAX_CONCURRENT_REQUESTS, max_queue_depth: int = MAX_QUEUE_DEPTH,
+                 max_wait: float = MAX_QUEUE_WAIT_SECONDS):
+        self.max_concurrent = max(1, max_concurrent)
+        self.max_queue_depth = max_queue_depth
+        self.max_wait = max_wait
+        self.in_flight = 0
+        self.waiters = [] # Heap of (priority, sequence, future)
+        self.queued = 0 # Waiters still pending (the heap may hold cancelled entries)
+        self._sequence = 0
+        self.admitted = 0
+        self.rejected: Dict[str, int] = {"queue_full": 0, "queue_timeout": 0, "preempted": 0}
+        self.wait_times = deque(maxlen=WAIT_SAMPLES)
+        self.service_times = deque(maxlen=WAIT_SAMPLES)
+
+    def _retry_after(self) -> float:
+        """Rough time until a newly queued request would be served."""
+        service_time = sum(self.service_times) / len(self.service_times) if self.service_times else 1.0
+        return service_time * (self.queued + 1) / self.max_concurrent
+
+    def _worst_waiter(self):
+        pending = [entry for entry in self.waiters if not entry[2].done()]
+        return max(pending, default=None)
+
+    def _wake_next(self):
+        while self.waiters and self.in_flight < self.max_concurrent:
+            _, _, future = heapq.heappop(self.waiters)
+            if future.done():
+                continue # Timed out or preempted
+            self.queued -= 1
+            self.in_flight += 1
+            future.set_result(True)
+
+    async def _acquire(self, priority: int):
+        if self.in_flight < self.max_concurrent and self.queued == 0:
+            self.in_flight += 1
+            return
+        if self.queued >= self.max_queue_depth:
+            worst = self._worst_waiter()
+            if worst is None or worst[0] <= priority:
+                self.rejected["queue_full"] += 1
+                raise Rejected("server busy, queue full", self._retry_after())
+            # Make room for the higher-priority request by turning away the newest lowest-priority waiter
+            worst[2].set_exception(Rejected("server busy, preempted by a higher-priority request", self._retry_after()))
+            self.queued -= 1
+            self.rejected["preempted"] += 1
+
+        future = asyncio.get_running_loop().create_future()
+        self._sequence += 1
+        heapq.heappush(self.waiters, (priority, self._sequence, future))
+        self.queued += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout=self.max_wait)
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled() and future.exception() is None:
+                return # Admitted just as the timeout fired
+            if not future.done():
+                future.cancel()
+                self.queued -= 1
+            self.rejected["queue_timeout"] += 1
+            raise Rejected("server busy, timed out in queue", self._retry_after())
+        except asyncio.CancelledError:
+            # Client went away while queued; give back the slot if we had just been admitted
+            if future.done() and not future.cancelled() and future.exception() is None:
+                self._release()
+            elif not future.done():
+                future.cancel()
+                self.queued -= 1
+            raise
+
+    def _release(self):
+        self.in_flight -= 1
+        self._wake_next()
+
+    async def _admit(self, priority: int) -> float:
+        """Waits for a work slot (or raises Rejected) and returns the time it was granted."""
+        queued_at = time.monotonic()
+        await self._acquire(priority)
+        started = time.monotonic()
+        self.admitted += 1
+        self.wait_times.append(started - queued_at)
+        if started - queued_at > 0.5:
+            logging.info(f"Request waited {started - queued_at:.2f}s in the admission queue (queue depth: {self.queued}).")
+        return started
+
+    def _finish(self, started: float):
+        self.service_times.append(time.monotonic() - started)
+        self._release()
+
+    @asynccontextmanager
+    async def slot(self, priority: int = PRIORITY_NEW_SESSION):
+        """Waits for a work slot (or raises Rejected) and holds it for the duration of the block."""
+        started = await self._admit(priority)
+        try:
+            yield
+        finally:
+            self._finish(started)
+
+    async def run(self, priority: int, func: Callable, *args) -> Any:
+        """
+        Runs func(*args) in a worker thread inside a work slot. If the caller is cancelled (client went
+        away), the thread can't be stopped, so the slot stays taken until the thread has finished.
+        """
+        started = await self._admit(priority)
+        try:
+            future = asyncio.get_running_loop().run_in_executor(None, functools.partial(func, *args))
+        except BaseException:
+            self._finish(started)
+            raise
+
+        def done(future):
+            if not future.cancelled():
+                future.exception()  # Mark as retrieved when nobody awaits the result any more
+            self._finish(started)
+
+        future.add_done_callback(done)
+        return await asyncio.shield(future)
+
+    def metrics(self) -> Dict:
+        waits = sorted(self.wait_times)
+        return {
+            "in_flight": self.in_flight,
+            "max_concurrent": self.max_concurrent,
+            "queue_depth": self.queued,
+            "max_queue_depth": self.max_queue_depth,
+            "admitted": self.admitted,
+            "rejected": dict(self.rejected),
+            "queue_wait_seconds": {
+                "avg": sum(waits) / len(waits) if waits else 0.0,
+                "p50": _percentile(waits, 0.50),
+                "p95": _percentile(waits, 0.95),
+                "p99": _percentile(waits, 0.99),
+                "max": waits[-1] if waits else 0.0,
+            },
+            "service_seconds_avg": sum(self.service_times) / len(self.service_times) if self.service_times else 0.0,
+        }
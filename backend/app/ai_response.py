@@ -3,7 +3,7 @@ import os
 from dotenv import load_dotenv
 from openai import OpenAI, APIError, APITimeoutError, RateLimitError
 import logging
-from typing import List, Dict, Union
+from typing import List, Dict, Union, Optional
 
 # Load environment variables
 load_dotenv()
@@ -26,13 +26,18 @@ except Exception as e:
 def generate_ai_response(context: str, # NOTE: Context is expected to be TURKISH
                          query: str,     # NOTE: Query is the ORIGINAL user query
                          current_date_str: str,
-                         history: List[Dict[str, str]]) -> str:
+                         history: List[Dict[str, str]],
+                         persona: Optional[Dict[str, str]] = None) -> str:
     """
     Uses OpenAI's API with optimized token usage. Assumes input 'context' is Turkish.
     Generates a date-aware, user-friendly answer in the language of the original 'query',
     considering conversation history and using few-shot examples.
+    'persona' (assistant_name, university_name) comes from the tenant; defaults to Thalassa / Sakarya University.
     """
     lang = detect_language(query) if 'detect_language' in globals() else 'en'
+    persona = persona or {}
+    assistant_name = persona.get("assistant_name", "Thalassa")
+    university_name = persona.get("university_name", "Sakarya University")
 
     if not client:
         return "Üzgünüm, AI servisi başlatılamadı." if lang == 'tr' else "Sorry, the AI service could not be initialized."
@@ -40,10 +45,10 @@ def generate_ai_response(context: str, # NOTE: Context is expected to be TURKISH
 
     # --- Condensed System Prompt ---
     system_prompt = f"""
-    You are Thalassa, a helpful AI assistant for Sakarya University students. Your name is Thalassa.
+    You are {assistant_name}, a helpful AI assistant for {university_name} students. Your name is {assistant_name}.
     Answer based ONLY on the provided 'Context' (likely Turkish) and 'Conversation History'.
     If info isn't in Context/History, state that clearly. Do not guess.
-    Be clear, direct, and helpful. Assume 'Sakarya University'.
+    Be clear, direct, and helpful. Assume '{university_name}'.
     Greet briefly on the first turn only. Ask for clarification if needed.
 
     Current Date: {current_date_str}
@@ -51,7 +56,7 @@ def generate_ai_response(context: str, # NOTE: Context is expected to be TURKISH
     *** INSTRUCTIONS ***
     1.  **Language:** Answer in the EXACT same language as the user's CURRENT 'Question' (e.g., Turkish/English). Understand the Turkish Context to do this.
     2.  **Context/History Use:** Rely solely on Context and History. Use history for follow-ups.
-    3.  **User Info Recall (CRITICAL):** If user stated their name in History, remember it. Address them by name occasionally. If asked "What is my name?", check History and state *their* name (e.g., "Adınız Emre."). NEVER confuse their name with yours (Thalassa).
+    3.  **User Info Recall (CRITICAL):** If user stated their name in History, remember it. Address them by name occasionally. If asked "What is my name?", check History and state *their* name (e.g., "Adınız Emre."). NEVER confuse their name with yours ({assistant_name}).
     4.  **Date Logic (Revised):** For date/schedule questions using Context/History:
         *   Compare relevant dates to Current Date ({current_date_str}).
         *   PRIORITY: First, state the event starting *soonest AFTER* the Current Date.
@@ -125,7 +130,7 @@ def generate_ai_response(context: str, # NOTE: Context is expected to be TURKISH
         if query.lower() in ["benim adım ne?", "what is my name?"] and \
            (answer.lower().startswith("benim adım") or answer.lower().startswith("my name is")):
              logging.warning(f"Potential name confusion detected! Query: '{query}', Incorrect Answer: '{answer}'. Forcing fallback.")
-             answer = "Benim adım Thalassa. Size nasıl yardımcı olabilirim?" if lang == 'tr' else "My name is Thalassa. How can I help you?"
+             answer = f"Benim adım {assistant_name}. Size nasıl yardımcı olabilirim?" if lang == 'tr' else f"My name is {assistant_name}. How can I help you?"
 
         return answer if answer else "Üzgünüm, bir yanıt oluşturamadım."
 
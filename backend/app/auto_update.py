@@ -1,55 +1,58 @@
 import os
 import time
+import shutil
 import faiss
 import numpy as np
 from sentence_transformers import SentenceTransformer
-from app.faiss_search import chunk_text, INDEX_FILE, METADATA_FILE
+from app.faiss_search import INDEX_FILE, METADATA_FILE, EMBEDDING_MODEL
+from app.chunking import append_chunk_records, CHUNKS_FILE, CHUNK_SIZE, CHUNK_OVERLAP
+from app.context_compression import BoilerplateLearner, load_boilerplate, save_boilerplate
+from app.ingestion import extract_pdf_texts, iter_document_chunks, index_records, indexed_files
 
 TEXT_FOLDER = "extracted_texts"
 CHECK_INTERVAL = 60  # Check for new files every 60 seconds
-CHUNK_SIZE = 500  
 
-# Load FAISS index & embedding model
-model = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
+# Load FAISS index & embedding model (must match the model the index was built with)
+model = SentenceTransformer(EMBEDDING_MODEL)
 index = faiss.read_index(INDEX_FILE)
 metadata = np.load(METADATA_FILE, allow_pickle=True).tolist()
 
-def extract_text_from_pdf(pdf_path):
-    """Extracts text from a PDF file."""
-    import fitz  # PyMuPDF
-    doc = fitz.open(pdf_path)
-    text = "\n".join([page.get_text("text") for page in doc])
-    return text
-
 def update_faiss():
-    """Scans for new PDFs, extracts text, and adds them to FAISS."""
-    new_files = [f for f in os.listdir(TEXT_FOLDER) if f.endswith(".pdf")]
+    """Scans for new PDFs, extracts text in a process pool, and streams their chunks into FAISS."""
+    known_files = indexed_files(metadata)
+    new_files = sorted(f for f in os.listdir(TEXT_FOLDER) if f.endswith(".pdf") and f not in known_files)
     
     if not new_files:
         return
 
     print(f"📂 Found {len(new_files)} new PDFs! Updating FAISS...")
 
-    new_chunks = []
+    boilerplate_learner = BoilerplateLearner()
     new_metadata = []
-    
-    for filename in new_files:
-        pdf_path = os.path.join(TEXT_FOLDER, filename)
-        text = extract_text_from_pdf(pdf_path)
-        text_chunks = chunk_text(text, CHUNK_SIZE)
-        
-        for i, chunk in enumerate(text_chunks):
-            new_chunks.append(chunk)
-            new_metadata.append((filename, i))
-
-    # Convert to embeddings & update FAISS
-    embeddings = model.encode(new_chunks, convert_to_numpy=True)
-    index.add(embeddings)
+    # New chunk records are staged and only appended to the store once the index is saved
+    staged_chunks_file = CHUNKS_FILE + ".new"
+    append_chunk_records(staged_chunks_file, [], mode="w")
+
+    def on_batch(batch):
+        append_chunk_records(staged_chunks_file, batch)
+        new_metadata.extend((record["file"], record["chunk"]) for record in batch)
+
+    pdf_paths = [os.path.join(TEXT_FOLDER, filename) for filename in new_files]
+    documents = ((os.path.basename(path), text.split("\n"))
+                 for path, text in extract_pdf_texts(pdf_paths) if text)
+    records = iter_document_chunks(documents, CHUNK_SIZE, CHUNK_OVERLAP, boilerplate_learner)
+
+    # Convert to embeddings & update FAISS batch by batch
+    index_records(records, model, EMBEDDING_MODEL, index=index, on_batch=on_batch)
     metadata.extend(new_metadata)
 
     # Save updated FAISS index
     faiss.write_index(index, INDEX_FILE)
     np.save(METADATA_FILE, np.array(metadata, dtype=object))
+    with open(staged_chunks_file, "r", encoding="utf-8") as staged, open(CHUNKS_FILE, "a", encoding="utf-8") as store:
+        shutil.copyfileobj(staged, store)
+    os.remove(staged_chunks_file)
+    save_boilerplate(load_boilerplate() | boilerplate_learner.lines())
 
     print("✅ FAISS updated with new documents!")
 
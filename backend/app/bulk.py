@@ -0,0 +1,145 @@
+# app/bulk.py
+import os
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from dotenv import load_dotenv
+
+from app.faiss_search import search_faiss_batch, index_registry
+from app.ai_response import generate_ai_response
+from app.translation import detect_language, translate_text
+from app.ingestion import iter_batches
+
+load_dotenv()
+
+# --- Configuration ---
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", 64)) # Queries searched together (one encode / index.search)
+BULK_LLM_CONCURRENCY = int(os.getenv("BULK_LLM_CONCURRENCY", 4)) # Parallel OpenAI calls when generating answers
+BULK_TRANSLATION_CONCURRENCY = int(os.getenv("BULK_TRANSLATION_CONCURRENCY", 8)) # Parallel MyMemory calls
+BULK_MAX_QUERIES = int(os.getenv("BULK_MAX_QUERIES", 1000)) # Per /chat/bulk request
+BULK_QUERIES_PER_MINUTE = float(os.getenv("BULK_QUERIES_PER_MINUTE", 300)) # Per client IP; each query costs one token
+# /chat/bulk?generate=true (billed OpenAI calls) requires this key in the X-API-Key header; disabled when unset
+BULK_API_KEY = os.getenv("BULK_API_KEY", "")
+# --- End Configuration ---
+
+
+def parse_jsonl(lines: Iterable[str]) -> Iterator[Dict]:
+    """
+    Parses JSONL query records: {"query": "...", "id": optional, "tenant": optional}.
+    A bare JSON string is accepted as the query. Invalid lines become records with an "error".
+    """
+    for line_number, line in enumerate(lines, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield {"id": line_number, "error": f"Invalid JSON on line {line_number}: {e.msg}"}
+            continue
+        if isinstance(record, str):
+            record = {"query": record}
+        if not isinstance(record, dict):
+            yield {"id": line_number, "error": f"Line {line_number} is not a JSON object or string."}
+            continue
+        record.setdefault("id", line_number)
+        yield record
+
+
+def _translate_queries(queries: List[str], langs: List[str]) -> List[str]:
+    """Translates non-English queries to English in parallel, translating each distinct query once."""
+    to_translate = sorted({(query, lang) for query, lang in zip(queries, langs) if lang != "en"})
+    translations = {}
+    if to_translate:
+        with ThreadPoolExecutor(max_workers=BULK_TRANSLATION_CONCURRENCY) as pool:
+            results = pool.map(lambda item: translate_text(item[0], item[1], "en"), to_translate)
+            translations = dict(zip(to_translate, results))
+    return [translations.get((query, lang), query) for query, lang in zip(queries, langs)]
+
+
+def process_batch(batch: List[Dict], default_tenant: Optional[str], generate: bool,
+                  llm_concurrency: int, include_context: bool) -> List[Dict]:
+    """Runs one batch of query records through the pipeline and returns their results in input order."""
+    results = []
+    valid = [] # (result, query, tenant_id) for records that can be searched
+    for record in batch:
+        result = {"id": record.get("id")}
+        results.append(result)
+        if "error" in record:
+            result["error"] = record["error"]
+            continue
+        query = record.get("query")
+        if not isinstance(query, str) or not query.strip():
+            result["error"] = "Query cannot be empty."
+            continue
+        try:
+            tenant_id = index_registry.resolve(record.get("tenant") or default_tenant)
+        except KeyError:
+            result["error"] = f"Unknown tenant: {record.get('tenant') or default_tenant}"
+            continue
+        result.update({"query": query, "tenant": tenant_id})
+        valid.append((result, query, tenant_id))
+
+    if not valid:
+        return results
+
+    # 1. Detect languages and translate to English for search/re-ranking
+    queries = [query for _, query, _ in valid]
+    langs = [detect_language(query) for query in queries]
+    search_queries = _translate_queries(queries, langs)
+    for (result, _, _), lang, search_query in zip(valid, langs, search_queries):
+        result["lang"] = lang
+        result["search_query"] = search_query
+
+    # 2. Vectorized search & re-ranking, one call per tenant present in the batch
+    contexts = [""] * len(valid)
+    for tenant_id in sorted({tenant_id for _, _, tenant_id in valid}):
+        positions = [i for i, (_, _, t) in enumerate(valid) if t == tenant_id]
+        tenant_contexts = search_faiss_batch([search_queries[i] for i in positions], tenant_id=tenant_id)
+        for i, context in zip(positions, tenant_contexts):
+            contexts[i] = context
+    for (result, _, _), context in zip(valid, contexts):
+        result["context_found"] = bool(context)
+        if include_context:
+            result["context"] = context
+
+    # 3. Optional answer generation with bounded concurrency (no conversation history in bulk mode)
+    if generate:
+        today_str = date.today().strftime("%Y-%m-%d")
+
+        def answer(i):
+            result, query, tenant_id = valid[i]
+            context = contexts[i] or ("İlgili bağlam bilgisi bulunamadı." if langs[i] == 'tr' else "No relevant context found.")
+            return generate_ai_response(context, query, today_str, [], index_registry.config(tenant_id))
+
+        with ThreadPoolExecutor(max_workers=max(1, llm_concurrency)) as pool:
+            for (result, _, _), final_answer in zip(valid, pool.map(answer, range(len(valid)))):
+                result["answer"] = final_answer
+    return results
+
+
+def run_bulk(records: Iterable[Dict],
+             tenant_id: Optional[str] = None,
+             generate: bool = False,
+             llm_concurrency: int = BULK_LLM_CONCURRENCY,
+             include_context: bool = False,
+             batch_size: int = BULK_BATCH_SIZE) -> Iterator[Dict]:
+    """
+    Runs detection, translation, search and re-ranking over query records in batches and yields
+    one result per record, in input order, as soon as its batch is done. Searching also warms the
+    embedding cache for every query.
+    """
+    processed = 0
+    for batch in iter_batches(records, batch_size):
+        yield from process_batch(batch, tenant_id, generate, llm_concurrency, include_context)
+        processed += len(batch)
+        logging.info(f"Bulk query progress: {processed} queries processed.")
+
+
+def to_ndjson(results: Iterable[Dict]) -> Iterator[str]:
+    """Serializes results as NDJSON lines."""
+    for result in results:
+        yield json.dumps(result, ensure_ascii=False) + "\n"
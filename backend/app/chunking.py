@@ -0,0 +1,323 @@
+# app/chunking.py
+import os
+import re
+import json
+import logging
+from typing import Dict, Iterable, Iterator, List, Tuple, Union
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# --- Configuration ---
+# Sizes are measured in tokens (see count_tokens), not characters or words.
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", 256))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", 32))
+# JSONL chunk store written at index time; line N holds the chunk behind FAISS vector N
+CHUNKS_FILE = os.getenv("CHUNKS_FILE", "data/chunks.jsonl")
+# --- End Configuration ---
+
+# Rough, model-agnostic tokenization: words, numbers and single punctuation marks.
+# Close enough to sub-word tokenizers for sizing chunks, and needs no model download.
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]", re.UNICODE)
+
+# Sentence ends: ., ! or ? followed by whitespace and an upper-case letter or digit.
+# Avoids splitting on dates like "6.01.2025" and on abbreviations followed by lower case.
+_SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s+(?=[A-ZÇĞİÖŞÜ0-9\"'(])")
+
+# Academic calendar lines usually carry a date ("6 Ocak 2025", "06.01.2025", "6-19 Ocak")
+_MONTHS = (r"(Ocak|Şubat|Mart|Nisan|Mayıs|Haziran|Temmuz|Ağustos|Eylül|Ekim|Kasım|Aralık|"
+           r"January|February|March|April|May|June|July|August|September|October|November|December)")
+_DATE_RE = re.compile(r"\b\d{1,2}[./-]\d{1,2}[./-]\d{2,4}\b|\b\d{1,2}\s*(-\s*\d{1,2}\s*)?" + _MONTHS,
+                      re.IGNORECASE)
+# Column separators used by PDF-to-text table output
+_COLUMN_SEP_RE = re.compile(r"\t|\s{3,}|\s\|\s")
+# Section numbers only ("1.", "2.3", "2.3.", "IV.", "A)"); a bare leading number ("15 gün içinde ...")
+# is usually a wrapped PDF line, not a heading
+_NUMBERED_HEADING_RE = re.compile(r"^(\d+(\.\d+)*\.|\d+(\.\d+)+|[IVX]+\.|[A-Z]\))\s+(?P<first>\S)")
+# Page number lines left by PDF-to-text ("Sayfa 3", "Page 3 of 12", "3/12", "- 3 -")
+_PAGE_NUMBER_LINE_RE = re.compile(r"^((sayfa|page)\s*)?[-–]?\s*\d+(\s*(/|of)\s*\d+)?\s*[-–]?$", re.IGNORECASE)
+
+HEADING_MAX_TOKENS = 15
+# A line with a date is a calendar row only if it is this short (longer ones are prose that mentions a date)
+DATE_ROW_MAX_TOKENS = 12
+# Lines up to this long that don't end a sentence are labels ("Ders Kayıtları"), not wrapped prose
+LABEL_MAX_TOKENS = 8
+
+# Unit kinds produced by the line classifier
+HEADING = "heading"
+TABLE_ROW = "row"
+PARAGRAPH = "paragraph"
+PAGE_NUMBER = "page"
+
+
+def count_tokens(text: str) -> int:
+    """Approximate token count used for chunk sizing."""
+    return len(_TOKEN_RE.findall(text))
+
+
+def split_sentences(text: str) -> List[Tuple[int, int]]:
+    """Returns (start, end) character offsets of the sentences in text."""
+    spans = []
+    start = 0
+    for match in _SENTENCE_END_RE.finditer(text):
+        if text[start:match.start()].strip():
+            spans.append((start, match.start()))
+        start = match.end()
+    if text[start:].strip():
+        spans.append((start, len(text.rstrip())))
+    return spans
+
+
+def _continues_sentence(paragraph: List[str]) -> bool:
+    """True if the open paragraph ends mid-sentence on a full-width line, i.e. the next line wraps it."""
+    if not paragraph:
+        return False
+    last = paragraph[-1]
+    return not last.endswith((".", "!", "?", ":")) and count_tokens(last) > LABEL_MAX_TOKENS
+
+
+def _classify_line(line: str, continues_sentence: bool = False, next_line: str = "") -> str:
+    """
+    Classifies a non-empty, stripped line as heading, page number, table row or paragraph text.
+    continues_sentence: the open paragraph ends mid-sentence, so this line most likely wraps it.
+    next_line: the following stripped line ("" at a blank line or the end).
+    """
+    if line.startswith("#"):
+        return HEADING
+    if _PAGE_NUMBER_LINE_RE.match(line):
+        return PAGE_NUMBER
+    if _COLUMN_SEP_RE.search(line):
+        return TABLE_ROW
+    tokens = count_tokens(line)
+    # Short, label-like lines with a date are calendar rows ("06.01.2025 Derslerin başlaması");
+    # wrapped prose ("başvurular 15 Ocak 2025 tarihine kadar kabul edilir, sonrasında gelen") is not
+    if (_DATE_RE.search(line) and tokens <= DATE_ROW_MAX_TOKENS
+            and not continues_sentence and not line[0].islower()):
+        return TABLE_ROW
+    if tokens <= HEADING_MAX_TOKENS and not line.endswith((".", ",", ";")):
+        letters = [c for c in line if c.isalpha()]
+        if letters and all(c.isupper() for c in letters):
+            return HEADING
+        if line.endswith(":"):
+            return HEADING
+        numbered = _NUMBERED_HEADING_RE.match(line)
+        # Sentence continuations start lower case after the number ("15. gün içinde ...")
+        if numbered and not numbered.group("first").islower():
+            return HEADING
+        # Mixed-case headings ("Devam Zorunluluğu") sit on a short line of their own, followed by a capitalized line
+        if (tokens <= LABEL_MAX_TOKENS and not continues_sentence and line[0].isupper()
+                and not line.endswith(("!", "?")) and next_line[:1].isupper()
+                and not _PAGE_NUMBER_LINE_RE.match(next_line)):
+            return HEADING
+    return PARAGRAPH
+
+
+def _with_next(lines: Iterable[str]) -> Iterator[Tuple[str, str]]:
+    """
+    Yields (line, next_line) pairs of stripped lines; next_line is "" after the last line.
+    Form feed lines (page breaks from extract_text_from_pdf) are skipped: sentences run across pages.
+    """
+    previous = None
+    for raw_line in lines:
+        line = raw_line.strip()
+        if not line and "\f" in raw_line:
+            continue
+        if previous is not None:
+            yield previous, line
+        previous = line
+    if previous is not None:
+        yield previous, ""
+
+
+def _iter_units(lines: Iterable[str], max_paragraph_tokens: int = CHUNK_SIZE) -> Iterator[Tuple[str, str]]:
+    """
+    Groups raw lines into structural units: headings, page numbers, single table rows and paragraphs.
+    Paragraphs end at blank lines and before headings, page numbers or table rows. PDF text rarely
+    has blank lines, so once a paragraph passes max_paragraph_tokens its complete sentences are
+    emitted and only the unfinished last one is kept open.
+    """
+    paragraph = []
+    paragraph_tokens = 0
+
+    def flush():
+        nonlocal paragraph, paragraph_tokens
+        if paragraph:
+            yield PARAGRAPH, " ".join(paragraph)
+        paragraph, paragraph_tokens = [], 0
+
+    for line, next_line in _with_next(lines):
+        if not line:
+            yield from flush()
+            continue
+        kind = _classify_line(line, _continues_sentence(paragraph), next_line)
+        if kind == TABLE_ROW:
+            line = _COLUMN_SEP_RE.sub(" | ", line)
+        elif kind == PARAGRAPH:
+            paragraph.append(line)
+            paragraph_tokens += count_tokens(line)
+            if paragraph_tokens > max_paragraph_tokens:
+                text = " ".join(paragraph)
+                spans = split_sentences(text)
+                cut = spans[-1][0] if len(spans) > 1 else len(text)
+                yield PARAGRAPH, text[:cut].strip()
+                rest = text[cut:].strip()
+                paragraph, paragraph_tokens = ([rest], count_tokens(rest)) if rest else ([], 0)
+            continue
+        yield from flush()
+        yield kind, line
+    yield from flush()
+
+
+def _split_oversized(text: str, chunk_size: int) -> List[str]:
+    """Splits a unit larger than chunk_size by sentences, then by words as a last resort."""
+    pieces = []
+    for start, end in split_sentences(text):
+        sentence = text[start:end]
+        if count_tokens(sentence) <= chunk_size:
+            pieces.append(sentence)
+            continue
+        words = sentence.split()
+        current = []
+        for word in words:
+            if current and count_tokens(" ".join(current + [word])) > chunk_size:
+                pieces.append(" ".join(current))
+                current = []
+            current.append(word)
+        if current:
+            pieces.append(" ".join(current))
+    return pieces
+
+
+def _build_chunk(heading: str, units: List[Tuple[str, str]]) -> Dict[str, Union[str, List[List[int]]]]:
+    """Joins units into chunk text and records the sentence offsets inside it."""
+    parts = ([heading] if heading else []) + [text for _, text in units]
+    sentences = []
+    offset = 0
+    for kind, part in ([(HEADING, heading)] if heading else []) + units:
+        if kind == PARAGRAPH:
+            sentences.extend([offset + s, offset + e] for s, e in split_sentences(part))
+        else:
+            # Headings and table rows are kept whole as a single "sentence"
+            sentences.append([offset, offset + len(part)])
+        offset += len(part) + 1  # "\n" separator
+    return {"text": "\n".join(parts), "sentences": sentences}
+
+
+def iter_chunks(text: Union[str, Iterable[str]],
+                chunk_size: int = CHUNK_SIZE,
+                overlap: int = CHUNK_OVERLAP) -> Iterator[Dict[str, Union[str, List[List[int]]]]]:
+    """
+    Structure-aware chunker. Accepts a string or an iterable of lines (e.g. an open file)
+    and lazily yields chunks as {"text": str, "sentences": [[start, end], ...]}.
+
+    - Headings start a new chunk and are repeated at the top of every chunk in their section.
+    - Table rows (academic calendar lines) are never split.
+    - Page number lines ("Sayfa 3") are kept as lines of their own, so boilerplate stripping can match them.
+    - Paragraphs are packed whole; only paragraphs larger than chunk_size are split by sentence.
+    - Up to `overlap` tokens of trailing units are carried into the next chunk of the same section.
+    """
+    lines = text.split("\n") if isinstance(text, str) else text  # Not splitlines(): keeps form feed page breaks
+    overlap = max(0, min(overlap, chunk_size // 2))
+
+    heading = ""
+    heading_tokens = 0
+    current: List[Tuple[str, str]] = []
+    current_tokens = 0
+    # Whether `current` holds anything besides units carried over as overlap
+    has_new_content = False
+
+    def flush(carry_overlap):
+        nonlocal current, current_tokens, has_new_content
+        if has_new_content:
+            yield _build_chunk(heading, current)
+        carried = []
+        carried_tokens = 0
+        if carry_overlap and has_new_content:
+            for unit in reversed(current):
+                unit_tokens = count_tokens(unit[1])
+                if carried_tokens + unit_tokens > overlap:
+                    break
+                carried.insert(0, unit)
+                carried_tokens += unit_tokens
+        current, current_tokens, has_new_content = carried, carried_tokens, False
+
+    previous_kind = None
+    for kind, unit_text in _iter_units(lines, chunk_size):
+        if kind == HEADING:
+            yield from flush(carry_overlap=False)
+            # Consecutive headings (e.g. "AKADEMİK TAKVİM" / "GÜZ YARIYILI") form one heading path
+            candidate = f"{heading}\n{unit_text}" if previous_kind == HEADING and heading else unit_text
+            # Overly long "headings" would eat the chunk budget; treat them as text
+            if count_tokens(candidate) <= chunk_size // 4:
+                heading = candidate
+                heading_tokens = count_tokens(heading)
+                previous_kind = HEADING
+                continue
+            heading, heading_tokens = "", 0
+            kind = PARAGRAPH
+        previous_kind = kind
+
+        budget = max(1, chunk_size - heading_tokens)
+        unit_tokens = count_tokens(unit_text)
+        pieces = [unit_text] if unit_tokens <= budget else _split_oversized(unit_text, budget)
+        for piece in pieces:
+            piece_tokens = count_tokens(piece)
+            if current and current_tokens + piece_tokens > budget:
+                yield from flush(carry_overlap=True)
+                # Drop carried units if they leave no room for the new piece
+                while current and current_tokens + piece_tokens > budget:
+                    current_tokens -= count_tokens(current.pop(0)[1])
+            current.append((kind, piece))
+            current_tokens += piece_tokens
+            has_new_content = True
+
+    yield from flush(carry_overlap=False)
+
+
+def chunk_text(text, chunk_size=CHUNK_SIZE, overlap=CHUNK_OVERLAP):
+    """Splits text into structure-aware chunks and returns their texts."""
+    return [chunk["text"] for chunk in iter_chunks(text, chunk_size, overlap)]
+
+
+def chunk_sentences(chunk: Dict[str, Union[str, List[List[int]]]]) -> List[str]:
+    """Returns the sentences of a chunk using its precomputed boundaries."""
+    text = chunk["text"]
+    return [text[start:end] for start, end in chunk.get("sentences", [])]
+
+
+# --- Chunk Store ---
+def make_chunk_record(filename: str, chunk_index: int, chunk: Dict) -> Dict:
+    """Builds the chunk store record for one chunk, aligned with a (filename, chunk_index) metadata entry."""
+    return {"file": filename, "chunk": chunk_index, "text": chunk["text"], "sentences": chunk["sentences"]}
+
+
+def append_chunk_records(chunks_file: str, records: Iterable[Dict], mode: str = "a") -> int:
+    """Appends chunk records to the JSONL chunk store (mode="w" starts a new store). Returns the count written."""
+    directory = os.path.dirname(chunks_file)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    written = 0
+    with open(chunks_file, mode, encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            written += 1
+    return written
+
+
+def load_chunk_store(chunks_file: str = CHUNKS_FILE) -> List[Dict]:
+    """Loads all chunk records from the chunk store (kept resident by the index registry)."""
+    if not os.path.exists(chunks_file):
+        return []
+    records = []
+    try:
+        with open(chunks_file, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    records.append(json.loads(line))
+    except Exception as e:
+        logging.error(f"Failed to load chunk store {chunks_file}: {e}", exc_info=True)
+        return []
+    logging.info(f"Loaded {len(records)} chunks from {chunks_file}.")
+    return records
+# --- End Chunk Store ---
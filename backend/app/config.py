@@ -8,4 +8,6 @@ OLLAMA_API_URL = os.getenv("OLLAMA_API_URL","http://localhost:11434/api/generate
 INDEX_FILE = "data/faiss_index.bin"
 METADATA_FILE = "data/metadata.npy"
 TEXT_FOLDER = "extracted_texts"
-CHUNK_SIZE = 500
\ No newline at end of file
+CHUNKS_FILE = "data/chunks.jsonl"
+CHUNK_SIZE = 256
+CHUNK_OVERLAP = 32
\ No newline at end of file
@@ -0,0 +1,356 @@
+# app/context_compression.py
+import os
+import re
+import json
+import hashlib
+import logging
+from collections import Counter
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Set
+
+import numpy as np
+from dotenv import load_dotenv
+
+from app.chunking import count_tokens, split_sentences, HEADING_MAX_TOKENS, _DATE_RE, _PAGE_NUMBER_LINE_RE
+
+load_dotenv()
+
+# --- Configuration ---
+BOILERPLATE_FILE = os.getenv("BOILERPLATE_FILE", "data/boilerplate.json")
+# A line counts as header/footer boilerplate if it repeats this often at page edges inside one file...
+BOILERPLATE_MIN_REPEATS = int(os.getenv("BOILERPLATE_MIN_REPEATS", 3))
+# ...or appears in at least this many different files
+BOILERPLATE_MIN_FILES = int(os.getenv("BOILERPLATE_MIN_FILES", 5))
+BOILERPLATE_MAX_TOKENS = 20  # Only short lines can be headers/footers
+# Distinct lines tracked across files; lines seen in a single file are pruned beyond this
+BOILERPLATE_MAX_TRACKED_LINES = int(os.getenv("BOILERPLATE_MAX_TRACKED_LINES", 100000))
+# Chunks whose SimHash fingerprints differ in at most this many bits are near-duplicates
+NEAR_DUPLICATE_MAX_BITS = int(os.getenv("NEAR_DUPLICATE_MAX_BITS", 3))
+# Query-focused sentence pruning
+CONTEXT_SENTENCE_PRUNING = os.getenv("CONTEXT_SENTENCE_PRUNING", "true").lower() == "true"
+CONTEXT_SENTENCE_MIN_SIMILARITY = float(os.getenv("CONTEXT_SENTENCE_MIN_SIMILARITY", 0.25))
+CONTEXT_MIN_SENTENCES_PER_CHUNK = int(os.getenv("CONTEXT_MIN_SENTENCES_PER_CHUNK", 2))
+# --- End Configuration ---
+
+# Page numbers in headers/footers: "Sayfa 3", "Page 3 of 12", "3/12", "- 3 -"
+_PAGE_NUMBER_RE = re.compile(r"\b(sayfa|page)\s*\d+(\s*(/|of)\s*\d+)?\b|\b\d+\s*/\s*\d+\b|^\W*\d+\W*$")
+_WHITESPACE_RE = re.compile(r"\s+")
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+# Optional exact token counting for the savings report
+try:
+    import tiktoken
+    _ENCODING = tiktoken.encoding_for_model(os.getenv("OPENAI_MODEL", "gpt-3.5-turbo"))
+except Exception:
+    _ENCODING = None
+
+
+def count_llm_tokens(text: str) -> int:
+    """Counts tokens with tiktoken when available, otherwise with the chunker's approximation."""
+    if _ENCODING is not None:
+        return len(_ENCODING.encode(text))
+    return count_tokens(text)
+
+
+def dedupe_key(text: str) -> str:
+    """Key for spotting repeated sentences: case and whitespace ignored, digits (dates!) kept."""
+    return _WHITESPACE_RE.sub(" ", text.strip().lower())
+
+
+def normalize_line(line: str) -> str:
+    """Normalizes a line for boilerplate matching: like dedupe_key, with page numbers collapsed."""
+    return _PAGE_NUMBER_RE.sub("#", dedupe_key(line))
+
+
+def is_boilerplate(line: str, boilerplate: Set[str]) -> bool:
+    """True if line is a learned header/footer line. Lines carrying a date never are."""
+    return normalize_line(line) in boilerplate and not _DATE_RE.search(line)
+
+
+# --- Boilerplate Learning (index time) ---
+class BoilerplateLearner:
+    """Collects repeated short lines across documents while they are being indexed."""
+
+    def __init__(self, min_repeats=BOILERPLATE_MIN_REPEATS, min_files=BOILERPLATE_MIN_FILES,
+                 max_tracked=BOILERPLATE_MAX_TRACKED_LINES):
+        self.min_repeats = min_repeats
+        self.min_files = min_files
+        self.max_tracked = max_tracked
+        self.file_counts = Counter()  # normalized line -> number of files containing it
+        self.boilerplate: Set[str] = set()
+
+    def observe(self, lines: Iterable[str]) -> Iterator[str]:
+        """
+        Passes the lines of one document through while counting them (for streaming ingestion).
+        Repeats inside one file only count at page edges (first/last line of a page): calendar labels
+        like "Ders Kayıtları" repeat once per semester, headers and footers once per page.
+        Pages end at form feeds and page number lines.
+        """
+        counts = Counter()
+        edge_counts = Counter()
+        previous = None  # Key of the previous non-empty line
+        page_start = True
+        for line in lines:
+            stripped = line.strip()
+            key = None
+            # Calendar lines repeat across files too, but they are the content, not a header
+            if stripped and count_tokens(stripped) <= BOILERPLATE_MAX_TOKENS and not _DATE_RE.search(stripped):
+                key = normalize_line(stripped)
+                counts[key] += 1
+            edges = {key} if page_start else set()
+            if stripped:
+                page_start = False
+            if "\f" in line or _PAGE_NUMBER_LINE_RE.match(stripped):
+                edges.update({key, previous})
+                page_start = True
+            for edge in edges - {None}:
+                edge_counts[edge] += 1
+            if stripped:
+                previous = key
+            yield line
+        self._add_counts(counts, edge_counts)
+
+    def add_document(self, lines: Iterable[str]):
+        """Counts the short lines of one document."""
+        for _ in self.observe(lines):
+            pass
+
+    def _add_counts(self, counts: Counter, edge_counts: Counter):
+        for line in counts:
+            self.file_counts[line] += 1
+        for line, count in edge_counts.items():
+            if count >= self.min_repeats:
+                self.boilerplate.add(line)
+        if len(self.file_counts) > self.max_tracked:
+            self._prune()
+
+    def _prune(self):
+        """
+        Keeps memory bounded on large corpora (lossy counting). Lines already seen in min_files files
+        are settled as boilerplate; of the rest, the least frequent are forgotten, starting with lines
+        seen in a single file. A forgotten line that is boilerplate after all needs a few more files.
+        """
+        before = len(self.file_counts)
+        self.boilerplate.update(line for line, files in self.file_counts.items() if files >= self.min_files)
+        pending = [(files, line) for line, files in self.file_counts.items() if 1 < files < self.min_files]
+        if len(pending) > self.max_tracked // 2:
+            pending = sorted(pending, reverse=True)[:self.max_tracked // 2]
+        self.file_counts = Counter({line: files for files, line in pending})
+        logging.info(f"Boilerplate learner pruned {before - len(self.file_counts)} rarely seen lines.")
+
+    def lines(self) -> Set[str]:
+        """Returns the normalized lines considered boilerplate so far."""
+        return self.boilerplate | {line for line, files in self.file_counts.items() if files >= self.min_files}
+
+
+def save_boilerplate(lines: Iterable[str], boilerplate_file: str = BOILERPLATE_FILE):
+    """Writes learned boilerplate lines to disk."""
+    directory = os.path.dirname(boilerplate_file)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(boilerplate_file, "w", encoding="utf-8") as f:
+        json.dump(sorted(lines), f, ensure_ascii=False, indent=0)
+
+
+_boilerplate_cache = {}  # path -> (mtime, set of lines)
+
+def load_boilerplate(boilerplate_file: str = BOILERPLATE_FILE) -> Set[str]:
+    """Loads learned boilerplate lines, re-reading the file only when it changes."""
+    if not os.path.exists(boilerplate_file):
+        return set()
+    mtime = os.path.getmtime(boilerplate_file)
+    cached = _boilerplate_cache.get(boilerplate_file)
+    if cached and cached[0] == mtime:
+        return cached[1]
+    try:
+        with open(boilerplate_file, "r", encoding="utf-8") as f:
+            lines = set(json.load(f))
+    except Exception as e:
+        logging.error(f"Failed to load boilerplate lines from {boilerplate_file}: {e}")
+        return set()
+    _boilerplate_cache[boilerplate_file] = (mtime, lines)
+    return lines
+# --- End Boilerplate Learning ---
+
+
+def simhash(text: str) -> int:
+    """64-bit SimHash over word 3-shingles."""
+    words = _WORD_RE.findall(text.lower())
+    shingles = [" ".join(words[i:i + 3]) for i in range(max(1, len(words) - 2))]
+    weights = [0] * 64
+    for shingle in shingles:
+        value = int.from_bytes(hashlib.md5(shingle.encode("utf-8")).digest()[:8], "big")
+        for bit in range(64):
+            weights[bit] += 1 if value >> bit & 1 else -1
+    return sum(1 << bit for bit in range(64) if weights[bit] > 0)
+
+
+def remove_near_duplicates(chunks: List[Dict], max_bits: int = NEAR_DUPLICATE_MAX_BITS) -> List[Dict]:
+    """Drops chunks whose SimHash is within max_bits of a higher-ranked chunk. Input order is rank order."""
+    kept, fingerprints = [], []
+    for chunk in chunks:
+        fingerprint = simhash(chunk["text"])
+        if any(bin(fingerprint ^ other).count("1") <= max_bits for other in fingerprints):
+            continue
+        kept.append(chunk)
+        fingerprints.append(fingerprint)
+    return kept
+
+
+def _chunk_sentences(chunks: List[Dict]) -> List[List[str]]:
+    """Drops near-duplicate chunks and splits the rest into sentences using the stored spans."""
+    sentences_per_chunk = []
+    for chunk in remove_near_duplicates(chunks):
+        spans = chunk.get("sentences") or split_sentences(chunk["text"])
+        sentences_per_chunk.append([chunk["text"][start:end].strip() for start, end in spans])
+    return sentences_per_chunk
+
+
+def _select_sentences(query_embedding: Optional[np.ndarray],
+                      sentences_per_chunk: List[List[str]],
+                      embeddings: Optional[np.ndarray]) -> List[List[str]]:
+    """
+    Keeps the sentences of each chunk most similar to the query, in their original order.
+    `embeddings` holds one row per sentence, in the order of the flattened sentences_per_chunk.
+    """
+    if query_embedding is None or embeddings is None or not len(embeddings):
+        return sentences_per_chunk
+
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    embeddings = embeddings / np.maximum(norms, 1e-12)
+    query = query_embedding.reshape(-1) / max(float(np.linalg.norm(query_embedding)), 1e-12)
+    scores = embeddings @ query
+
+    selected = []
+    position = 0
+    for sentences in sentences_per_chunk:
+        chunk_scores = scores[position:position + len(sentences)]
+        position += len(sentences)
+        keep = {i for i, score in enumerate(chunk_scores) if score >= CONTEXT_SENTENCE_MIN_SIMILARITY}
+        keep.update(np.argsort(-chunk_scores)[:CONTEXT_MIN_SENTENCES_PER_CHUNK].tolist())
+        if sentences:
+            keep.add(0)  # First sentence is the heading or paragraph lead; keeps remaining lines in context
+        selected.append([sentence for i, sentence in enumerate(sentences) if i in keep])
+    return selected
+
+
+def _is_label(sentence: str) -> bool:
+    """Headings and calendar labels ("Ders Kayıtları"): short, no date, not a full sentence."""
+    return (count_tokens(sentence) <= HEADING_MAX_TOKENS and not _DATE_RE.search(sentence)
+            and not sentence.endswith((".", "!", "?")))
+
+
+def _join_context(chunks: List[Dict], sentences_per_chunk: List[List[str]], boilerplate: Set[str]) -> Dict:
+    """
+    Strips boilerplate and repeated sentences, joins the chunks and reports the savings.
+    A repeated label is kept when the line after it is new: "Ders Kayıtları" is the same under
+    every semester, but the date following it is not.
+    """
+    original = "\n---\n".join(chunk["text"] for chunk in chunks)
+    seen = set()
+    parts = []
+    for sentences in sentences_per_chunk:
+        kept = []
+        pending_labels = []  # Repeated labels waiting to see whether the next line is new
+        for sentence in sentences:
+            lines = [line for line in sentence.split("\n") if line.strip() and not is_boilerplate(line, boilerplate)]
+            sentence = "\n".join(lines)
+            if not sentence:
+                continue
+            key = dedupe_key(sentence)
+            if key not in seen:
+                seen.add(key)
+                kept.extend(pending_labels)
+                kept.append(sentence)
+                pending_labels = []
+            elif _is_label(sentence):
+                pending_labels.append(sentence)
+            else:
+                pending_labels = []
+        if kept:
+            parts.append("\n".join(kept))
+
+    context = "\n---\n".join(parts)
+    original_tokens = count_llm_tokens(original)
+    context_tokens = count_llm_tokens(context)
+    return {
+        "context": context,
+        "chunks_in": len(chunks),
+        "chunks_out": len(parts),
+        "chars_saved": len(original) - len(context),
+        "tokens_saved": original_tokens - context_tokens,
+        "original_tokens": original_tokens,
+    }
+
+
+def compress_contexts(chunk_lists: List[List[Dict]],
+                      query_embeddings: Optional[Sequence[np.ndarray]] = None,
+                      encode: Optional[Callable[[List[str]], np.ndarray]] = None,
+                      boilerplate: Optional[Set[str]] = None) -> List[Dict]:
+    """
+    Batch form of compress_context for several queries (one list of re-ranked chunks per query).
+    The sentences of all contexts are embedded with a single encode call for sentence pruning.
+    """
+    sentences_per_context = [_chunk_sentences(chunks) for chunks in chunk_lists]
+
+    embeddings_per_context = [None] * len(chunk_lists)
+    if CONTEXT_SENTENCE_PRUNING and query_embeddings is not None and encode is not None:
+        flat = [sentence for sentences_per_chunk in sentences_per_context
+                for sentences in sentences_per_chunk for sentence in sentences]
+        if flat:
+            embeddings = encode(flat)
+            position = 0
+            for i, sentences_per_chunk in enumerate(sentences_per_context):
+                count = sum(len(sentences) for sentences in sentences_per_chunk)
+                embeddings_per_context[i] = embeddings[position:position + count]
+                position += count
+
+    results = []
+    for i, (chunks, sentences_per_chunk) in enumerate(zip(chunk_lists, sentences_per_context)):
+        query_embedding = query_embeddings[i] if query_embeddings is not None else None
+        sentences_per_chunk = _select_sentences(query_embedding, sentences_per_chunk, embeddings_per_context[i])
+        results.append(_join_context(chunks, sentences_per_chunk, boilerplate or set()))
+    return results
+
+
+def compress_context(chunks: List[Dict],
+                     query_embedding: Optional[np.ndarray] = None,
+                     encode: Optional[Callable[[List[str]], np.ndarray]] = None,
+                     boilerplate: Optional[Set[str]] = None) -> Dict:
+    """
+    Post-processes re-ranked chunks ({"text", "sentences"}) before they go into the prompt:
+    near-duplicate removal, query-focused sentence pruning, boilerplate stripping and
+    removal of sentences repeated across chunks (overlap). Returns the context and savings.
+
+    Sentences that differ only in a date are distinct:
+
+    >>> chunks = [{"text": "Derslerin başlaması: 6 Ocak 2025"}, {"text": "Derslerin başlaması: 13 Ocak 2025"}]
+    >>> print(compress_context(chunks, boilerplate={"derslerin başlaması: 6 ocak 2025"})["context"])
+    Derslerin başlaması: 6 Ocak 2025
+    ---
+    Derslerin başlaması: 13 Ocak 2025
+
+    Event labels repeated under every semester are neither boilerplate nor duplicates:
+
+    >>> from app.chunking import iter_chunks
+    >>> calendar = ["GÜZ YARIYILI", "Ders Kayıtları", "23-27 Eylül 2024", "Final Sınavları", "6-19 Ocak 2025",
+    ...             "BAHAR YARIYILI", "Ders Kayıtları", "10-14 Şubat 2025", "Final Sınavları", "16-29 Haziran 2025",
+    ...             "YAZ OKULU", "Ders Kayıtları", "7-11 Temmuz 2025", "Final Sınavları", "1-3 Eylül 2025"]
+    >>> learner = BoilerplateLearner()
+    >>> learner.add_document(calendar)
+    >>> learner.lines()
+    set()
+    >>> print(compress_context(list(iter_chunks(calendar))[:2], boilerplate=learner.lines())["context"])
+    GÜZ YARIYILI
+    Ders Kayıtları
+    23-27 Eylül 2024
+    Final Sınavları
+    6-19 Ocak 2025
+    ---
+    BAHAR YARIYILI
+    Ders Kayıtları
+    10-14 Şubat 2025
+    Final Sınavları
+    16-29 Haziran 2025
+    """
+    query_embeddings = None if query_embedding is None else [query_embedding]
+    return compress_contexts([chunks], query_embeddings, encode, boilerplate)[0]
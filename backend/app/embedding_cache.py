@@ -0,0 +1,207 @@
+# app/embedding_cache.py
+import os
+import re
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+
+try:
+    import fcntl  # Cross-process append lock (POSIX only)
+except ImportError:
+    fcntl = None
+
+load_dotenv()
+
+# --- Configuration ---
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE", "true").lower() == "true"
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", "data/embedding_cache")
+EMBEDDING_CACHE_LRU_SIZE = int(os.getenv("EMBEDDING_CACHE_LRU_SIZE", 4096)) # Vectors kept in memory
+# --- End Configuration ---
+
+_WHITESPACE_RE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Normalizes text before hashing so trivially different inputs share a cache entry."""
+    return _WHITESPACE_RE.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+
+def cache_key(model_name: str, text: str) -> str:
+    """Content address of an embedding: hash of model name plus normalized text."""
+    return hashlib.sha1(f"{model_name}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Append-only, memory-mapped store of float32 embeddings for one model, with an in-memory LRU front.
+
+    Files in `<cache_dir>/<model>/`:
+      - vectors.f32: raw float32 rows, appended only
+      - keys.txt:    "<key> <row>" lines, appended after the row is written
+    Several processes (server, auto_update, index builder) can share the same files;
+    appends are serialized with a file lock and each process picks up the others' keys on a miss.
+    """
+
+    def __init__(self, model_name: str, cache_dir: str = EMBEDDING_CACHE_DIR, lru_size: int = EMBEDDING_CACHE_LRU_SIZE):
+        self.model_name = model_name
+        self.directory = os.path.join(cache_dir, re.sub(r"[^\w.-]", "_", model_name))
+        self.vectors_file = os.path.join(self.directory, "vectors.f32")
+        self.keys_file = os.path.join(self.directory, "keys.txt")
+        self.lru_size = lru_size
+        self.rows: Dict[str, int] = {}
+        self.lru: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self.dim: Optional[int] = None
+        self._keys_offset = 0 # How far keys.txt has been read
+        self._mmap = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.directory, exist_ok=True)
+        self._refresh_keys()
+
+    def _refresh_keys(self):
+        """Reads key lines appended since the last refresh (possibly by another process)."""
+        if not os.path.exists(self.keys_file):
+            return
+        with open(self.keys_file, "r", encoding="ascii") as f:
+            f.seek(self._keys_offset)
+            for line in f:
+                if not line.endswith("\n"):
+                    break # Partially written line; read it next time
+                parts = line.split()
+                if len(parts) == 3 and parts[0] == "dim":
+                    self.dim = int(parts[1])
+                elif len(parts) == 2:
+                    self.rows[parts[0]] = int(parts[1])
+                self._keys_offset += len(line)
+
+    def _read_row(self, row: int) -> Optional[np.ndarray]:
+        """Reads one vector from the memory-mapped file, remapping it if the file has grown."""
+        if self._mmap is None or row >= self._mmap.shape[0]:
+            rows = os.path.getsize(self.vectors_file) // (self.dim * 4)
+            if row >= rows:
+                return None
+            self._mmap = np.memmap(self.vectors_file, dtype=np.float32, mode="r", shape=(rows, self.dim))
+        return np.array(self._mmap[row])
+
+    def _lookup(self, key: str) -> Optional[np.ndarray]:
+        vector = self.lru.get(key)
+        if vector is not None:
+            self.lru.move_to_end(key)
+            return vector
+        row = self.rows.get(key)
+        if row is None or self.dim is None:
+            return None
+        vector = self._read_row(row)
+        if vector is not None:
+            self._remember(key, vector)
+        return vector
+
+    def _remember(self, key: str, vector: np.ndarray):
+        self.lru[key] = vector
+        self.lru.move_to_end(key)
+        while len(self.lru) > self.lru_size:
+            self.lru.popitem(last=False)
+
+    def _append(self, keys: List[str], vectors: np.ndarray):
+        """Appends new vectors and their keys to disk under a cross-process lock."""
+        with open(self.keys_file, "a", encoding="ascii") as keys_f:
+            if fcntl:
+                fcntl.flock(keys_f, fcntl.LOCK_EX)
+            try:
+                self._refresh_keys()
+                if self.dim is None:
+                    self.dim = vectors.shape[1]
+                    keys_f.write(f"dim {self.dim} float32\n")
+                elif self.dim != vectors.shape[1]:
+                    raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match cache dimension {self.dim}")
+                with open(self.vectors_file, "ab") as vectors_f:
+                    row_bytes = self.dim * 4
+                    size = vectors_f.seek(0, os.SEEK_END)
+                    first_row = size // row_bytes
+                    if size != first_row * row_bytes:
+                        # A write was interrupted mid-row; drop the partial row so new rows stay aligned.
+                        # Keys are written after their rows, so no key points at it.
+                        logging.warning(f"Truncating partial row at the end of {self.vectors_file} ({size % row_bytes} bytes).")
+                        vectors_f.truncate(first_row * row_bytes)
+                    vectors_f.write(np.ascontiguousarray(vectors, dtype=np.float32).tobytes())
+                for i, key in enumerate(keys):
+                    keys_f.write(f"{key} {first_row + i}\n")
+                keys_f.flush()
+            finally:
+                if fcntl:
+                    fcntl.flock(keys_f, fcntl.LOCK_UN)
+        self._refresh_keys()
+
+    def encode(self, model, texts: List[str], batch_size: int = 32, show_progress_bar: bool = False) -> np.ndarray:
+        """Returns float32 embeddings for texts, encoding only those not already cached."""
+        keys = [cache_key(self.model_name, text) for text in texts]
+        results: List[Optional[np.ndarray]] = [None] * len(texts)
+        with self._lock:
+            missing = {}
+            for i, key in enumerate(keys):
+                results[i] = self._lookup(key)
+                if results[i] is None:
+                    missing.setdefault(key, []).append(i)
+            if missing:
+                # Another process may have added them since our last refresh
+                self._refresh_keys()
+                for key in list(missing):
+                    vector = self._lookup(key)
+                    if vector is not None:
+                        for i in missing.pop(key):
+                            results[i] = vector
+            self.hits += len(texts) - sum(len(positions) for positions in missing.values())
+            self.misses += sum(len(positions) for positions in missing.values())
+
+        if missing:
+            missing_keys = list(missing)
+            missing_texts = [texts[missing[key][0]] for key in missing_keys]
+            vectors = np.asarray(model.encode(missing_texts, batch_size=batch_size, convert_to_numpy=True,
+                                              show_progress_bar=show_progress_bar), dtype=np.float32)
+            with self._lock:
+                try:
+                    self._append(missing_keys, vectors)
+                except Exception as e:
+                    logging.error(f"Failed to write embeddings to cache {self.directory}: {e}")
+                for key, vector in zip(missing_keys, vectors):
+                    self._remember(key, vector)
+                    for i in missing[key]:
+                        results[i] = vector
+
+        if not results:
+            return np.zeros((0, self.dim or 0), dtype=np.float32)
+        # Always a fresh array: callers normalize in place (faiss.normalize_L2)
+        return np.stack(results).astype(np.float32, copy=True)
+
+
+_caches: Dict[str, EmbeddingCache] = {}
+_caches_lock = threading.Lock()
+
+def get_embedding_cache(model_name: str) -> EmbeddingCache:
+    """Returns the process-wide cache for a model."""
+    with _caches_lock:
+        if model_name not in _caches:
+            _caches[model_name] = EmbeddingCache(model_name)
+        return _caches[model_name]
+
+
+def encode_with_cache(model, model_name: str, texts: List[str], batch_size: int = 32,
+                      show_progress_bar: bool = False) -> np.ndarray:
+    """Drop-in for model.encode(texts, convert_to_numpy=True) backed by the embedding cache."""
+    if not EMBEDDING_CACHE_ENABLED:
+        return np.asarray(model.encode(texts, batch_size=batch_size, convert_to_numpy=True,
+                                       show_progress_bar=show_progress_bar), dtype=np.float32)
+    try:
+        cache = get_embedding_cache(model_name)
+    except Exception as e:
+        logging.error(f"Embedding cache unavailable, encoding without it: {e}")
+        return np.asarray(model.encode(texts, batch_size=batch_size, convert_to_numpy=True,
+                                       show_progress_bar=show_progress_bar), dtype=np.float32)
+    return cache.encode(model, texts, batch_size=batch_size, show_progress_bar=show_progress_bar)
@@ -1,11 +1,14 @@
 import os
-import numpy as np
 import faiss
 from sentence_transformers import SentenceTransformer, CrossEncoder
 import glob
 from dotenv import load_dotenv
 import logging
 import time
+from app.chunking import iter_chunks, CHUNK_SIZE, CHUNK_OVERLAP, CHUNKS_FILE
+from app.context_compression import compress_contexts, BOILERPLATE_FILE
+from app.embedding_cache import encode_with_cache
+from app.tenants import IndexRegistry, load_tenant_configs
 
 load_dotenv()
 
@@ -17,7 +20,6 @@ TEXT_FOLDER = os.getenv("TEXT_FOLDER", "extracted_texts")
 EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "paraphrase-multilingual-mpnet-base-v2")
 # --- Use Cross-Encoder Model ---
 CROSS_ENCODER_MODEL = os.getenv("CROSS_ENCODER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
-CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", 400))
 # --- Retrieval & Re-ranking K values ---
 FAISS_RETRIEVAL_K = int(os.getenv("FAISS_RETRIEVAL_K", 10)) # How many to get from FAISS initially
 FINAL_CONTEXT_K = int(os.getenv("FINAL_CONTEXT_K", 4)) # How many to send to LLM after re-ranking
@@ -41,6 +43,16 @@ except Exception as e:
     cross_encoder_model = None
 # --- End Model Initialization ---
 
+# --- Tenant Index Registry (indexes per university/faculty, models shared) ---
+index_registry = IndexRegistry(load_tenant_configs({
+    "index_file": INDEX_FILE,
+    "metadata_file": METADATA_FILE,
+    "chunks_file": CHUNKS_FILE,
+    "boilerplate_file": BOILERPLATE_FILE,
+    "text_folder": TEXT_FOLDER,
+}))
+# --- End Tenant Index Registry ---
+
 def load_texts_for_retrieval(text_folder, required_files):
     """Loads content only for specified files."""
     loaded_texts = {}
@@ -59,104 +71,150 @@ def load_texts_for_retrieval(text_folder, required_files):
             logging.warning(f"Required file {filename} from metadata not found in {text_folder}")
     return loaded_texts
 
-def chunk_text(text, chunk_size=CHUNK_SIZE):
-    """Splits text into smaller chunks by words."""
-    words = text.split()
-    return [" ".join(words[i:i+chunk_size]) for i in range(0, len(words), chunk_size)]
+def _retrieve_candidates(tenant_index, candidate_ids):
+    """Returns (chunk_record, metadata_index) pairs for the FAISS ids of one query."""
+    config = tenant_index.config
+    metadata = tenant_index.metadata
+    candidates = [] # Store tuples of (chunk_record, original_metadata_index)
+    valid_indices = [idx for idx in candidate_ids if 0 <= idx < len(metadata)]
 
-def search_faiss(query_en, # Expect English query for search/reranking
-                 index_file=INDEX_FILE,
-                 metadata_file=METADATA_FILE,
-                 text_folder=TEXT_FOLDER,
-                 retrieval_k=FAISS_RETRIEVAL_K,
-                 final_k=FINAL_CONTEXT_K):
+    # Prefer the chunk store written at index time (no re-chunking per request)
+    chunk_store = tenant_index.chunks
+    if len(chunk_store) == len(metadata):
+        for idx in valid_indices:
+            candidates.append((chunk_store[idx], idx))
+        return candidates
+
+    if chunk_store:
+        logging.warning(f"Chunk store {config['chunks_file']} has {len(chunk_store)} entries but metadata has {len(metadata)}. Re-chunking source files.")
+    required_files = set()
+    for idx in valid_indices:
+        filename, _ = metadata[idx]
+        required_files.add(filename)
+
+    # Load only necessary text files
+    loaded_texts = load_texts_for_retrieval(config["text_folder"], required_files)
+
+    # Process valid indices to get chunks
+    for idx in valid_indices:
+        filename, chunk_index = metadata[idx]
+        if filename in loaded_texts:
+            full_text = loaded_texts[filename]
+            chunks = list(iter_chunks(full_text, CHUNK_SIZE, CHUNK_OVERLAP))
+            if 0 <= chunk_index < len(chunks):
+                candidates.append((chunks[chunk_index], idx)) # Keep track of original index if needed
+            else:
+                logging.warning(f"Chunk index {chunk_index} out of range for file {filename} (found {len(chunks)} chunks)")
+    return candidates
+
+def search_faiss_batch(queries_en, # Expect English queries for search/reranking
+                       tenant_id=None,
+                       retrieval_k=FAISS_RETRIEVAL_K,
+                       final_k=FINAL_CONTEXT_K):
     """
-    Search FAISS using an English query, retrieve initial candidates,
-    re-rank using a Cross-Encoder, and return the top N most relevant chunks.
+    Vectorized search for several English queries against one tenant's index: one encode call,
+    one FAISS search over the query matrix and one Cross-Encoder pass over all candidate pairs.
+    Returns one context string per query ("" when nothing relevant was found).
     """
+    if not queries_en:
+        return []
     start_time = time.time()
-    logging.info(f"Starting FAISS search & re-ranking for query (en): '{query_en[:50]}...'")
+    empty = [""] * len(queries_en)
+    logging.info(f"Starting FAISS search & re-ranking for {len(queries_en)} query(s) (en), first: '{queries_en[0][:50]}...' (tenant: {tenant_id or 'default'})")
 
     if not embedding_model or not cross_encoder_model:
         logging.error("Search cannot proceed: Embedding or Cross-encoder model not loaded.")
-        return ""
-    if not os.path.exists(index_file) or not os.path.exists(metadata_file):
-         logging.error(f"FAISS index file ({index_file}) or metadata file ({metadata_file}) not found.")
-         return ""
+        return empty
+    config = index_registry.config(tenant_id)
+    if not os.path.exists(config["index_file"]) or not os.path.exists(config["metadata_file"]):
+         logging.error(f"FAISS index file ({config['index_file']}) or metadata file ({config['metadata_file']}) not found.")
+         return empty
 
     try:
-        # 1. Encode the English query using the Multilingual model
-        query_embedding = embedding_model.encode([query_en], convert_to_numpy=True)
-        faiss.normalize_L2(query_embedding) # Normalize query embedding
+        # 1. Encode the English queries using the Multilingual model (cached for repeated queries)
+        query_embeddings = encode_with_cache(embedding_model, EMBEDDING_MODEL, list(queries_en))
+        faiss.normalize_L2(query_embeddings) # Normalize query embeddings
 
-        # 2. Load FAISS Index and Metadata
-        index = faiss.read_index(index_file)
-        metadata = np.load(metadata_file, allow_pickle=True)
+        # 2. Get the tenant's resident FAISS Index and Metadata (loaded once, reloaded when rebuilt)
+        tenant_index = index_registry.get(tenant_id)
 
-        # 3. Perform Initial FAISS Search
+        # 3. Perform Initial FAISS Search over the whole query matrix
         logging.debug(f"Performing FAISS search with retrieval_k={retrieval_k}")
-        distances, indices = index.search(query_embedding, retrieval_k)
+        distances, indices = tenant_index.index.search(query_embeddings, retrieval_k)
         faiss_time = time.time()
         logging.debug(f"FAISS search completed in {faiss_time - start_time:.4f} seconds.")
 
-        if indices.size == 0 or indices[0][0] == -1: # Check if search returned anything
-            logging.info("FAISS search returned no initial candidates.")
-            return ""
-
         # 4. Retrieve Initial Text Chunks
-        initial_chunks_data = [] # Store tuples of (chunk_text, original_metadata_index)
-        required_files = set()
-        valid_indices = [idx for idx in indices[0] if 0 <= idx < len(metadata)]
-
-        for idx in valid_indices:
-            filename, _ = metadata[idx]
-            required_files.add(filename)
-
-        # Load only necessary text files
-        loaded_texts = load_texts_for_retrieval(text_folder, required_files)
-
-        # Process valid indices to get chunks
-        for idx in valid_indices:
-            filename, chunk_index = metadata[idx]
-            if filename in loaded_texts:
-                full_text = loaded_texts[filename]
-                chunks = chunk_text(full_text, CHUNK_SIZE)
-                if 0 <= chunk_index < len(chunks):
-                    initial_chunks_data.append((chunks[chunk_index], idx)) # Keep track of original index if needed
-                else:
-                    logging.warning(f"Chunk index {chunk_index} out of range for file {filename} (found {len(chunks)} chunks)")
-
-        if not initial_chunks_data:
+        candidates_per_query = []
+        for row in indices:
+            if row.size == 0 or row[0] == -1: # Check if search returned anything
+                candidates_per_query.append([])
+            else:
+                candidates_per_query.append(_retrieve_candidates(tenant_index, row))
+
+        total_candidates = sum(len(candidates) for candidates in candidates_per_query)
+        if not total_candidates:
             logging.info("No valid text chunks retrieved after FAISS search.")
-            return ""
+            return empty
 
-        logging.info(f"Retrieved {len(initial_chunks_data)} initial candidates from FAISS.")
+        logging.info(f"Retrieved {total_candidates} initial candidates from FAISS.")
 
-        # 5. Re-rank using Cross-Encoder
+        # 5. Re-rank all (query, chunk) pairs using the Cross-Encoder in one pass
         logging.debug("Starting cross-encoder re-ranking...")
-        cross_encoder_input = [[query_en, chunk_data[0]] for chunk_data in initial_chunks_data]
+        cross_encoder_input = [[query_en, chunk_data[0]["text"]]
+                               for query_en, candidates in zip(queries_en, candidates_per_query)
+                               for chunk_data in candidates]
         cross_scores = cross_encoder_model.predict(cross_encoder_input, show_progress_bar=False)
         rerank_time = time.time()
         logging.debug(f"Cross-encoder prediction completed in {rerank_time - faiss_time:.4f} seconds.")
 
-        # Combine chunks with their scores
-        scored_chunks = list(zip([chunk_data[0] for chunk_data in initial_chunks_data], cross_scores))
-
-        # Sort by score (descending)
-        scored_chunks.sort(key=lambda x: x[1], reverse=True)
-
-        # 6. Select Top N Chunks after Re-ranking
-        top_reranked_chunks = [chunk[0] for chunk in scored_chunks[:final_k]]
+        reranked_per_query = []
+        position = 0
+        for candidates in candidates_per_query:
+            # Combine chunks with their scores
+            scored_chunks = list(zip([chunk_data[0] for chunk_data in candidates],
+                                     cross_scores[position:position + len(candidates)]))
+            position += len(candidates)
+
+            # Sort by score (descending)
+            scored_chunks.sort(key=lambda x: x[1], reverse=True)
+
+            # 6. Select Top N Chunks after Re-ranking
+            reranked_per_query.append([chunk[0] for chunk in scored_chunks[:final_k]])
+
+        # 7. Compress: drop near-duplicates, boilerplate and sentences unrelated to the query.
+        # The sentences of all queries' contexts are embedded in one call.
+        with_candidates = [i for i, chunks in enumerate(reranked_per_query) if chunks]
+        compressed_contexts = compress_contexts(
+            [reranked_per_query[i] for i in with_candidates],
+            query_embeddings=[query_embeddings[i] for i in with_candidates],
+            encode=lambda sentences: encode_with_cache(embedding_model, EMBEDDING_MODEL, sentences),
+            boilerplate=tenant_index.boilerplate,
+        )
+        contexts = list(empty)
+        for i, compressed in zip(with_candidates, compressed_contexts):
+            logging.info(f"Context compression: {compressed['chunks_in']} -> {compressed['chunks_out']} chunks, "
+                         f"saved {compressed['chars_saved']} chars and {compressed['tokens_saved']} of {compressed['original_tokens']} tokens.")
+            contexts[i] = compressed["context"]
 
         end_time = time.time()
-        logging.info(f"Search & re-ranking completed in {end_time - start_time:.4f} seconds. Returning {len(top_reranked_chunks)} chunks.")
+        logging.info(f"Search & re-ranking of {len(queries_en)} queries completed in {end_time - start_time:.4f} seconds.")
 
-        # Join the best chunks for the final context
-        return "\n---\n".join(top_reranked_chunks)
+        return contexts
 
     except FileNotFoundError as e:
         logging.error(f"FAISS file access error during search: {e}")
-        return ""
+        return empty
     except Exception as e:
         logging.error(f"Error during FAISS search or re-ranking: {e}", exc_info=True)
-        return ""
\ No newline at end of file
+        return empty
+
+def search_faiss(query_en, # Expect English query for search/reranking
+                 tenant_id=None,
+                 retrieval_k=FAISS_RETRIEVAL_K,
+                 final_k=FINAL_CONTEXT_K):
+    """
+    Search the tenant's FAISS index using an English query, retrieve initial candidates,
+    re-rank using a Cross-Encoder, and return the top N most relevant chunks.
+    """
+    return search_faiss_batch([query_en], tenant_id, retrieval_k, final_k)[0]
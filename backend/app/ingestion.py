@@ -0,0 +1,137 @@
+# app/ingestion.py
+import os
+import logging
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+import faiss
+from dotenv import load_dotenv
+
+from app.chunking import iter_chunks, make_chunk_record, CHUNK_SIZE, CHUNK_OVERLAP
+from app.context_compression import BoilerplateLearner
+from app.embedding_cache import encode_with_cache
+
+load_dotenv()
+
+# --- Configuration ---
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", 256)) # Chunks held in memory / encoded at a time
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", os.cpu_count() or 1))
+MERGED_FILE_NAME = "hepsi.txt" # Output of utils/merge_txt_files.py, never indexed
+# --- End Configuration ---
+
+
+def extract_text_from_pdf(pdf_path):
+    """Extracts text from a PDF file. Pages are separated by a form feed line (page edges for boilerplate learning)."""
+    import fitz  # PyMuPDF
+    with fitz.open(pdf_path) as doc:
+        return "\n\f\n".join(page.get_text("text") for page in doc)
+
+
+def extract_pdf_texts(pdf_paths: List[str], workers: int = PDF_WORKERS) -> Iterator[Tuple[str, Optional[str]]]:
+    """
+    Extracts PDFs in a process pool and yields (path, text) in input order.
+    Text is None for PDFs that failed to extract.
+    """
+    if not pdf_paths:
+        return
+    if workers <= 1 or len(pdf_paths) == 1:
+        for path in pdf_paths:
+            yield path, _safe_extract(path)
+        return
+    workers = min(workers, len(pdf_paths))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        # Keep a bounded window of submitted PDFs so finished texts don't pile up in memory
+        pending = deque()
+        paths = iter(pdf_paths)
+        for path in islice(paths, workers * 2):
+            pending.append((path, pool.submit(_safe_extract, path)))
+        while pending:
+            path, future = pending.popleft()
+            next_path = next(paths, None)
+            if next_path is not None:
+                pending.append((next_path, pool.submit(_safe_extract, next_path)))
+            yield path, future.result()
+
+
+def _safe_extract(pdf_path):
+    try:
+        return extract_text_from_pdf(pdf_path)
+    except Exception as e:
+        logging.error(f"Failed to extract text from {pdf_path}: {e}")
+        return None
+
+
+def iter_text_files(text_folder: str, extension: str = ".txt") -> Iterator[str]:
+    """Yields the names of the source files in text_folder, sorted, skipping the merged file."""
+    for filename in sorted(os.listdir(text_folder)):
+        if filename.endswith(extension) and filename != MERGED_FILE_NAME:
+            yield filename
+
+
+def iter_file_lines(file_path: str) -> Iterator[str]:
+    """Streams a text file line by line."""
+    with open(file_path, "r", encoding="utf-8") as f:
+        yield from f
+
+
+def iter_document_chunks(documents: Iterable[Tuple[str, Iterable[str]]],
+                         chunk_size: int = CHUNK_SIZE,
+                         overlap: int = CHUNK_OVERLAP,
+                         boilerplate_learner: Optional[BoilerplateLearner] = None) -> Iterator[Dict]:
+    """Lazily chunks (filename, lines) documents into chunk store records."""
+    for filename, lines in documents:
+        if boilerplate_learner is not None:
+            lines = boilerplate_learner.observe(lines)
+        count = 0
+        try:
+            for i, chunk in enumerate(iter_chunks(lines, chunk_size, overlap)):
+                count += 1
+                yield make_chunk_record(filename, i, chunk)
+        except Exception as e:
+            logging.error(f"Failed to read or process file {filename}: {e}")
+        if count:
+            logging.info(f"Processed '{filename}': {count} chunks created.")
+        else:
+            logging.warning(f"Skipping empty file: {filename}")
+
+
+def iter_batches(items: Iterable, batch_size: int = INGEST_BATCH_SIZE) -> Iterator[List]:
+    """Groups an iterable into lists of at most batch_size items."""
+    iterator = iter(items)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def index_records(records: Iterable[Dict],
+                  model,
+                  model_name: str,
+                  index=None,
+                  on_batch: Optional[Callable[[List[Dict]], None]] = None,
+                  batch_size: int = INGEST_BATCH_SIZE):
+    """
+    Encodes chunk records in fixed-size batches and adds the normalized vectors to the index
+    as they are produced. `on_batch` is called with each batch after it is added (e.g. to append
+    it to the chunk store). Creates an IndexFlatIP on the first batch if no index is given.
+    Returns the index (None if there were no records).
+    """
+    for batch in iter_batches(records, batch_size):
+        embeddings = encode_with_cache(model, model_name, [record["text"] for record in batch])
+        faiss.normalize_L2(embeddings)
+        if index is None:
+            index = faiss.IndexFlatIP(embeddings.shape[1])
+            logging.info(f"Created FAISS index with dimension: {embeddings.shape[1]} using IndexFlatIP.")
+        index.add(embeddings)
+        if on_batch:
+            on_batch(batch)
+        logging.info(f"Indexed {index.ntotal} chunks so far.")
+    return index
+
+
+def indexed_files(metadata) -> Set[str]:
+    """Returns the filenames already present in the metadata."""
+    return {filename for filename, _ in metadata}
@@ -1,16 +1,23 @@
 import logging
-from fastapi import FastAPI, HTTPException, Query
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 import os
 from datetime import date
 import uuid # For session IDs
-from typing import List, Dict, Optional # For type hinting
+import secrets
+from typing import List, Dict, Optional, Tuple # For type hinting
 
 # Import your functions
-from app.faiss_search import search_faiss
+from app.faiss_search import search_faiss, index_registry
 from app.ai_response import generate_ai_response
 from app.translation import detect_language, translate_to_english
+from app.bulk import (parse_jsonl, process_batch, to_ndjson, BULK_BATCH_SIZE, BULK_LLM_CONCURRENCY, BULK_MAX_QUERIES,
+                      BULK_QUERIES_PER_MINUTE, BULK_API_KEY)
+from app.ingestion import iter_batches
+from app.admission import (AdmissionController, RateLimiter, Rejected, PRIORITY_CONTINUING_SESSION, PRIORITY_NEW_SESSION,
+                           PRIORITY_BULK, SESSION_RATE_PER_MINUTE, SESSION_BURST, IP_RATE_PER_MINUTE, IP_BURST)
 
 # Load environment variables
 load_dotenv()
@@ -25,9 +32,31 @@ app = FastAPI(title="Thalassa AI Assistant API (Enhanced RAG)")
 # WARNING: This is for demonstration ONLY. It's not persistent, not scalable,
 #          and will lose history if the server restarts.
 #          Use a database or proper session management in production.
-conversation_memory: Dict[str, List[Dict[str, str]]] = {}
+#          Keyed by (tenant_id, session_id) so sessions never leak across tenants.
+conversation_memory: Dict[Tuple[str, str], List[Dict[str, str]]] = {}
 # --- End Memory Store ---
 
+# --- Admission Control & Rate Limiting ---
+admission_controller = AdmissionController()
+session_rate_limiter = RateLimiter("session", SESSION_RATE_PER_MINUTE, SESSION_BURST)
+ip_rate_limiter = RateLimiter("ip", IP_RATE_PER_MINUTE, IP_BURST)
+# Bulk requests pay per query; the burst lets one maximum-size request through at once
+bulk_rate_limiter = RateLimiter("bulk queries", BULK_QUERIES_PER_MINUTE, BULK_MAX_QUERIES)
+bulk_stats = {"requests": 0, "queries": 0, "batches": 0, "rejected_batches": 0}
+
+def check_rate_limits(request: Request, session_key=None):
+    """Applies the per-IP and (for known sessions) per-session token buckets; 429 with Retry-After when empty."""
+    client_ip = request.client.host if request.client else "unknown"
+    try:
+        ip_rate_limiter.check(client_ip)
+        if session_key is not None:
+            session_rate_limiter.check(session_key)
+    except Rejected as e:
+        logging.warning(f"Rate limited request from {client_ip} (session: {session_key}): {e.reason}.")
+        raise HTTPException(status_code=429, detail=f"Too many requests ({e.reason}). Please slow down.",
+                            headers={"Retry-After": str(e.retry_after)})
+# --- End Admission Control & Rate Limiting ---
+
 # CORS Middleware
 origins = ["http://localhost:3000"]
 app.add_middleware(
@@ -42,37 +71,11 @@ app.add_middleware(
 def read_root():
     return {"message": "Welcome to the Thalassa AI Assistant API (Enhanced RAG)"}
 
-@app.get("/chat")
-async def chat(query: str,
-               session_id: Optional[str] = Query(None, description="Unique ID for the conversation session.")):
+def answer_query(query: str, session_id: str, tenant_id: str, persona: Dict[str, str]) -> str:
     """
-    Enhanced Chatbot API endpoint: Handles context retrieval with re-ranking,
-    conversation history, date awareness, and few-shot prompting via OpenAI.
-    Returns the answer along with the session ID.
+    Runs the blocking RAG pipeline for one query (detection, translation, search, re-ranking,
+    OpenAI call) and updates the session history. Called from a worker thread by /chat.
     """
-    MAX_QUERY_LENGTH = 200
-
-    # --- Session ID Handling ---
-    if session_id is None:
-        session_id = str(uuid.uuid4())
-        logging.info(f"No session ID provided, generated new one: {session_id}")
-    else:
-        logging.info(f"Using existing session ID: {session_id}")
-    # --- End Session ID Handling ---
-
-    if not query or query.isspace():
-        logging.warning(f"[{session_id}] Received empty query.")
-        raise HTTPException(status_code=400, detail="Query cannot be empty.")
-
-    if len(query) > MAX_QUERY_LENGTH:
-        logging.warning(f"[{session_id}] Query exceeds maximum length: {len(query)} chars.")
-        raise HTTPException(
-            status_code=400,
-            detail=f"Message cannot exceed {MAX_QUERY_LENGTH} characters."
-        )
-
-    logging.info(f"[{session_id}] Received original query: '{query}'")
-
     # Get Current Date
     today_str = date.today().strftime("%Y-%m-%d")
     logging.info(f"[{session_id}] Current date for context: {today_str}")
@@ -91,7 +94,7 @@ async def chat(query: str,
     # 3. Search FAISS & Re-rank for Context using the ENGLISH query
     logging.info(f"[{session_id}] Searching FAISS & re-ranking with English query...")
     # search_faiss internally uses FINAL_CONTEXT_K from env/defaults now
-    context = search_faiss(search_query)
+    context = search_faiss(search_query, tenant_id=tenant_id)
 
     if context:
         logging.info(f"[{session_id}] FAISS search & re-ranking returned context based on '{search_query}'.")
@@ -100,13 +103,13 @@ async def chat(query: str,
         context = "İlgili bağlam bilgisi bulunamadı." if original_lang == 'tr' else "No relevant context found."
 
     # --- Retrieve Conversation History ---
-    history = conversation_memory.get(session_id, [])
+    history = conversation_memory.get((tenant_id, session_id), [])
     logging.info(f"[{session_id}] Retrieved history length: {len(history)//2} turns.")
     # --- End History Retrieval ---
 
     # 4. Generate AI Response using OpenAI (passing history and date)
     logging.info(f"[{session_id}] Generating AI response for original query: '{query}' with history and date...")
-    final_answer = generate_ai_response(context, query, today_str, history)
+    final_answer = generate_ai_response(context, query, today_str, history, persona)
     logging.info(f"[{session_id}] AI response generated.")
 
     # --- Update Conversation History ---
@@ -116,12 +119,147 @@ async def chat(query: str,
     # Keep only the last MAX_HISTORY_TURNS * 2 messages (user + assistant)
     if len(history) > MAX_HISTORY_TURNS * 2:
         history = history[-(MAX_HISTORY_TURNS * 2):]
-    conversation_memory[session_id] = history
+    conversation_memory[(tenant_id, session_id)] = history
     logging.info(f"[{session_id}] Updated history. New length: {len(history)//2} turns.")
     # --- End History Update ---
 
+    return final_answer
+
+@app.get("/chat")
+async def chat(request: Request,
+               query: str,
+               session_id: Optional[str] = Query(None, description="Unique ID for the conversation session."),
+               tenant: Optional[str] = Query(None, description="University/faculty whose index and persona to use. Defaults to the main index.")):
+    """
+    Enhanced Chatbot API endpoint: Handles context retrieval with re-ranking,
+    conversation history, date awareness, and few-shot prompting via OpenAI.
+    Returns the answer along with the session ID.
+    """
+    MAX_QUERY_LENGTH = 200
+
+    # --- Tenant Resolution ---
+    try:
+        tenant_id = index_registry.resolve(tenant)
+    except KeyError:
+        logging.warning(f"Unknown tenant requested: '{tenant}'")
+        raise HTTPException(status_code=404, detail=f"Unknown tenant: {tenant}")
+    persona = index_registry.config(tenant_id)
+    # --- End Tenant Resolution ---
+
+    # --- Rate Limiting (per IP, and per session for client-provided session IDs) ---
+    check_rate_limits(request, (tenant_id, session_id) if session_id is not None else None)
+
+    # --- Session ID Handling ---
+    if session_id is None:
+        session_id = str(uuid.uuid4())
+        logging.info(f"No session ID provided, generated new one: {session_id}")
+    else:
+        logging.info(f"Using existing session ID: {session_id}")
+    # --- End Session ID Handling ---
+
+    if not query or query.isspace():
+        logging.warning(f"[{session_id}] Received empty query.")
+        raise HTTPException(status_code=400, detail="Query cannot be empty.")
+
+    if len(query) > MAX_QUERY_LENGTH:
+        logging.warning(f"[{session_id}] Query exceeds maximum length: {len(query)} chars.")
+        raise HTTPException(
+            status_code=400,
+            detail=f"Message cannot exceed {MAX_QUERY_LENGTH} characters."
+        )
+
+    logging.info(f"[{session_id}] Received original query: '{query}'")
+
+    # --- Admission Control ---
+    # Continuing conversations are queued ahead of new ones; overload is rejected fast with 429
+    priority = PRIORITY_CONTINUING_SESSION if (tenant_id, session_id) in conversation_memory else PRIORITY_NEW_SESSION
+    try:
+        # The pipeline is CPU/network bound; run it off the event loop so queued requests stay responsive
+        final_answer = await admission_controller.run(priority, answer_query, query, session_id, tenant_id, persona)
+    except Rejected as e:
+        logging.warning(f"[{session_id}] Request rejected by admission control: {e.reason}. Retry after {e.retry_after}s.")
+        raise HTTPException(status_code=429, detail=f"Server is busy ({e.reason}). Please try again shortly.",
+                            headers={"Retry-After": str(e.retry_after)})
+    # --- End Admission Control ---
+
     # 5. Return the response including the session ID
-    return {"query": query, "answer": final_answer, "session_id": session_id}
+    return {"query": query, "answer": final_answer, "session_id": session_id, "tenant": tenant_id}
+
+
+@app.post("/chat/bulk")
+async def chat_bulk(request: Request,
+                    tenant: Optional[str] = Query(None, description="Default tenant for records without a 'tenant' field."),
+                    generate: bool = Query(False, description="Also generate LLM answers (slower, billed; requires X-API-Key)."),
+                    concurrency: int = Query(BULK_LLM_CONCURRENCY, ge=1, le=32, description="Parallel LLM calls when generating."),
+                    include_context: bool = Query(False, description="Include the retrieved context in each result.")):
+    """
+    Bulk query endpoint for offline evaluation and cache pre-warming. The request body is JSONL
+    ({"query": ..., "id": ..., "tenant": ...} per line). Queries are searched and re-ranked in
+    vectorized batches and results are streamed back as NDJSON, one line per input record.
+    """
+    try:
+        index_registry.resolve(tenant)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"Unknown tenant: {tenant}")
+    check_rate_limits(request)
+
+    body = (await request.body()).decode("utf-8", errors="replace")
+    records = list(parse_jsonl(body.splitlines()))
+    if not records:
+        raise HTTPException(status_code=400, detail="Request body must contain at least one JSONL query record.")
+    if len(records) > BULK_MAX_QUERIES:
+        raise HTTPException(status_code=413, detail=f"At most {BULK_MAX_QUERIES} queries per request.")
+    if generate and not (BULK_API_KEY and secrets.compare_digest(request.headers.get("X-API-Key", ""), BULK_API_KEY)):
+        raise HTTPException(status_code=403, detail="Answer generation in bulk requires a valid X-API-Key.")
+    client_ip = request.client.host if request.client else "unknown"
+    try:
+        bulk_rate_limiter.check(client_ip, cost=len(records))
+    except Rejected as e:
+        logging.warning(f"Rate limited bulk request of {len(records)} queries from {client_ip}: {e.reason}.")
+        raise HTTPException(status_code=429, detail=f"Too many bulk queries ({e.reason}). Please slow down.",
+                            headers={"Retry-After": str(e.retry_after)})
+
+    logging.info(f"Bulk request: {len(records)} queries, tenant={tenant or 'default'}, generate={generate}, concurrency={concurrency}.")
+    bulk_stats["requests"] += 1
+
+    async def stream_results():
+        # Each batch takes an admission slot at the lowest priority, so bulk work shares the
+        # /chat concurrency limit instead of competing with it
+        processed = 0
+        for batch in iter_batches(records, BULK_BATCH_SIZE):
+            try:
+                results = await admission_controller.run(PRIORITY_BULK, process_batch, batch, tenant, generate,
+                                                         concurrency, include_context)
+            except Rejected as e:
+                # Don't keep queueing behind interactive traffic: fail the rest so the client can retry them later
+                bulk_stats["rejected_batches"] += 1
+                logging.warning(f"Bulk request rejected by admission control after {processed} queries: {e.reason}.")
+                error = f"Server is busy ({e.reason}). Retry after {e.retry_after}s."
+                for line in to_ndjson({"id": record.get("id"), "error": error} for record in records[processed:]):
+                    yield line
+                return
+            processed += len(batch)
+            bulk_stats["batches"] += 1
+            bulk_stats["queries"] += len(batch)
+            for line in to_ndjson(results):
+                yield line
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+
+@app.get("/metrics")
+def metrics():
+    """Admission queue, rate limiter and bulk metrics (queue depth, in-flight work, wait times, rejections)."""
+    return {
+        "admission": admission_controller.metrics(),
+        "rate_limits": {
+            "session": {"tracked": len(session_rate_limiter.buckets), "rejected": session_rate_limiter.rejected},
+            "ip": {"tracked": len(ip_rate_limiter.buckets), "rejected": ip_rate_limiter.rejected},
+            "bulk": {"tracked": len(bulk_rate_limiter.buckets), "rejected": bulk_rate_limiter.rejected},
+        },
+        "bulk": dict(bulk_stats),
+        "resident_tenants": list(index_registry.loaded),
+    }
 
 
 # Direct run block
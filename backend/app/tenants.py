@@ -0,0 +1,176 @@
+# app/tenants.py
+import os
+import json
+import logging
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+import faiss
+from dotenv import load_dotenv
+
+from app.chunking import load_chunk_store
+from app.context_compression import load_boilerplate
+
+load_dotenv()
+
+# --- Configuration ---
+TENANTS_FILE = os.getenv("TENANTS_FILE", "tenants.json")
+DEFAULT_TENANT = os.getenv("DEFAULT_TENANT", "default")
+INDEX_MEMORY_BUDGET_MB = int(os.getenv("INDEX_MEMORY_BUDGET_MB", 2048)) # For all resident indexes together
+# --- End Configuration ---
+
+# Rough in-memory size of parsed JSON chunk records relative to their size on disk
+CHUNK_STORE_MEMORY_FACTOR = 3
+
+DEFAULT_PERSONA = {"assistant_name": "Thalassa", "university_name": "Sakarya University"}
+
+# Files that make up one tenant's index; a change to any of them means a reload
+INDEX_FILE_KEYS = ("index_file", "metadata_file", "chunks_file", "boilerplate_file")
+
+
+def tenant_defaults(tenant_id: str) -> Dict[str, str]:
+    """Default file layout for a tenant that only overrides some paths: everything under its own folder."""
+    return {
+        "index_file": f"data/{tenant_id}/faiss_index.bin",
+        "metadata_file": f"data/{tenant_id}/metadata.npy",
+        "chunks_file": f"data/{tenant_id}/chunks.jsonl",
+        "boilerplate_file": f"data/{tenant_id}/boilerplate.json",
+        "text_folder": f"extracted_texts/{tenant_id}",
+        **DEFAULT_PERSONA,
+    }
+
+
+def load_tenant_configs(default_config: Dict[str, str], tenants_file: str = TENANTS_FILE) -> Dict[str, Dict[str, str]]:
+    """
+    Reads tenant definitions from a JSON object of {tenant_id: {index_file, metadata_file, chunks_file,
+    boilerplate_file, text_folder, assistant_name, university_name}}. Missing keys fall back to
+    tenant_defaults(). The DEFAULT_TENANT always exists and uses the global INDEX_FILE/METADATA_FILE/... settings.
+    """
+    configs = {DEFAULT_TENANT: {**DEFAULT_PERSONA, **default_config}}
+    if not os.path.exists(tenants_file):
+        return configs
+    try:
+        with open(tenants_file, "r", encoding="utf-8") as f:
+            tenants = json.load(f)
+    except Exception as e:
+        logging.error(f"Failed to read tenants file {tenants_file}: {e}")
+        return configs
+    for tenant_id, overrides in tenants.items():
+        base = configs[DEFAULT_TENANT] if tenant_id == DEFAULT_TENANT else tenant_defaults(tenant_id)
+        configs[tenant_id] = {**base, **overrides}
+    logging.info(f"Loaded {len(configs)} tenants from {tenants_file}: {sorted(configs)}")
+    return configs
+
+
+class TenantIndex:
+    """Resident search resources of one tenant: FAISS index, metadata, chunk store and boilerplate lines."""
+
+    def __init__(self, tenant_id: str, config: Dict[str, str]):
+        self.tenant_id = tenant_id
+        self.config = config
+        self.file_mtimes = self._file_mtimes()
+        self.index = faiss.read_index(config["index_file"])
+        self.metadata = np.load(config["metadata_file"], allow_pickle=True)
+        self.chunks: List[Dict] = load_chunk_store(config["chunks_file"])
+        self.boilerplate = load_boilerplate(config["boilerplate_file"])
+        chunks_size = os.path.getsize(config["chunks_file"]) if os.path.exists(config["chunks_file"]) else 0
+        self.memory_bytes = (os.path.getsize(config["index_file"]) + os.path.getsize(config["metadata_file"])
+                             + chunks_size * CHUNK_STORE_MEMORY_FACTOR)
+        # Mtimes are taken before reading, so a load that overlaps a rebuild is stale on the next request.
+        # Mismatched counts are only reported: search re-chunks source files when the chunk store is off.
+        self.consistent = self._counts_match()
+
+    def _file_mtimes(self) -> Dict[str, Optional[float]]:
+        return {key: os.path.getmtime(self.config[key]) if os.path.exists(self.config[key]) else None
+                for key in INDEX_FILE_KEYS}
+
+    def _counts_match(self) -> bool:
+        """Whether FAISS ids, metadata and chunk store line up (a missing chunk store is expected for old indexes)."""
+        counts = {"index": self.index.ntotal, "metadata": len(self.metadata)}
+        if os.path.exists(self.config["chunks_file"]):
+            counts["chunks"] = len(self.chunks)
+        if len(set(counts.values())) > 1:
+            logging.warning(f"Index files of tenant '{self.tenant_id}' are out of step: {counts}")
+            return False
+        return True
+
+    def is_stale(self) -> bool:
+        """True if any index file was rebuilt or updated on disk (reload.sh / auto_update.py) since loading."""
+        try:
+            return self._file_mtimes() != self.file_mtimes
+        except OSError:
+            return False
+
+
+class IndexRegistry:
+    """
+    Maps tenant ids to their resident TenantIndex. Indexes are loaded lazily on first use and the least
+    recently used ones are unloaded when the total estimated size exceeds the memory budget.
+    Models are not part of a tenant: all tenants share the process-wide embedding and cross-encoder models.
+    """
+
+    def __init__(self, configs: Dict[str, Dict[str, str]], memory_budget_mb: int = INDEX_MEMORY_BUDGET_MB):
+        self.configs = configs
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        self.loaded: "OrderedDict[str, TenantIndex]" = OrderedDict()
+        self._lock = threading.Lock() # Guards `loaded`; never held while reading from disk
+        self._tenant_locks: Dict[str, threading.Lock] = {} # One load at a time per tenant
+
+    def resolve(self, tenant_id: Optional[str]) -> str:
+        """Returns the tenant id to use, raising KeyError for unknown tenants."""
+        tenant_id = tenant_id or DEFAULT_TENANT
+        if tenant_id not in self.configs:
+            raise KeyError(tenant_id)
+        return tenant_id
+
+    def config(self, tenant_id: Optional[str]) -> Dict[str, str]:
+        return self.configs[self.resolve(tenant_id)]
+
+    def _resident(self, tenant_id: str) -> Optional[TenantIndex]:
+        """Returns the tenant's index if it is loaded and up to date. Caller holds self._lock."""
+        tenant_index = self.loaded.get(tenant_id)
+        if tenant_index is not None and not tenant_index.is_stale():
+            self.loaded.move_to_end(tenant_id)
+            return tenant_index
+        return None
+
+    def get(self, tenant_id: Optional[str]) -> TenantIndex:
+        """Returns the tenant's resident index, loading (or reloading) it if needed."""
+        tenant_id = self.resolve(tenant_id)
+        with self._lock:
+            tenant_index = self._resident(tenant_id)
+            if tenant_index is not None:
+                return tenant_index
+            tenant_lock = self._tenant_locks.setdefault(tenant_id, threading.Lock())
+
+        # Load outside the registry lock so other tenants are served meanwhile
+        with tenant_lock:
+            with self._lock:
+                tenant_index = self._resident(tenant_id) # Loaded by another request while we waited
+                if tenant_index is not None:
+                    return tenant_index
+                previous = self.loaded.get(tenant_id)
+            if previous is not None:
+                logging.info(f"Index files of tenant '{tenant_id}' changed on disk. Reloading.")
+
+            logging.info(f"Loading index for tenant '{tenant_id}'...")
+            tenant_index = TenantIndex(tenant_id, self.configs[tenant_id])
+            # Cached even if inconsistent: reloading can't fix the files, and the next change on disk triggers a reload
+            with self._lock:
+                self.loaded[tenant_id] = tenant_index
+                self.loaded.move_to_end(tenant_id)
+                self._evict()
+                logging.info(f"Tenant '{tenant_id}' loaded ({tenant_index.index.ntotal} vectors, "
+                             f"~{tenant_index.memory_bytes / 1024 / 1024:.1f} MB). Resident tenants: {list(self.loaded)}")
+            return tenant_index
+
+    def _evict(self):
+        """Unloads least recently used tenants until under budget, always keeping the newest one."""
+        while len(self.loaded) > 1 and self.memory_used() > self.memory_budget:
+            tenant_id, _ = self.loaded.popitem(last=False)
+            logging.info(f"Unloaded index of tenant '{tenant_id}' (memory budget {self.memory_budget // 1024 // 1024} MB).")
+
+    def memory_used(self) -> int:
+        return sum(tenant_index.memory_bytes for tenant_index in self.loaded.values())
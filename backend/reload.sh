@@ -11,10 +11,11 @@ fi
 DATA_FOLDER="${DATA_FOLDER:-data}" # Default to 'data' if not set
 UTILS_FOLDER="utils"
 TEXT_FOLDER="${TEXT_FOLDER:-extracted_texts}" # Default to 'extracted_texts'
-MERGE_TXT_FILE="$UTILS_FOLDER/merge_txt_files.py"
 CREATE_FAISS_INDEX_FILE="$UTILS_FOLDER/create_faiss_index.py"
 FAISS_INDEX_FILE="${INDEX_FILE:-$DATA_FOLDER/faiss_index.bin}" # Default if not set
 METADATA_FILE="${METADATA_FILE:-$DATA_FOLDER/metadata.npy}" # Default if not set
+CHUNKS_FILE="${CHUNKS_FILE:-$DATA_FOLDER/chunks.jsonl}" # Default if not set
+BOILERPLATE_FILE="${BOILERPLATE_FILE:-$DATA_FOLDER/boilerplate.json}" # Default if not set
 
 # Function to check if python3 command exists
 command_exists() {
@@ -56,8 +57,8 @@ mkdir -p "$UTILS_FOLDER"
 
 
 # Delete the .bin and .npy files in the data folder
-echo "Deleting existing FAISS index and metadata files..."
-rm -f "$FAISS_INDEX_FILE" "$METADATA_FILE"
+echo "Deleting existing FAISS index, metadata and chunk store files..."
+rm -f "$FAISS_INDEX_FILE" "$METADATA_FILE" "$CHUNKS_FILE" "$BOILERPLATE_FILE"
 if [ $? -eq 0 ]; then
     echo "Deleted existing index files (if any)."
 else
@@ -65,19 +66,7 @@ else
 fi
 
 
-# Run merge_txt_files.py
-echo "------------------------------------"
-echo "Running merge_txt_files.py..."
-echo "------------------------------------"
-$PYTHON_CMD "$MERGE_TXT_FILE"
-if [ $? -ne 0 ]; then
-  echo "Error: merge_txt_files.py failed."
-  exit 1
-fi
-echo "merge_txt_files.py completed."
-
-
-# Run create_faiss_index.py
+# Run create_faiss_index.py (streams the text files directly; no merged copy of the corpus is needed)
 echo "------------------------------------"
 echo "Running create_faiss_index.py..."
 echo "------------------------------------"
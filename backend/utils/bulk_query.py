@@ -0,0 +1,44 @@
+import os
+import sys
+import argparse
+import logging
+
+# Allow importing the shared app package when run as `python utils/bulk_query.py`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Configure logging (to stderr, so NDJSON on stdout stays clean)
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+from app.bulk import parse_jsonl, run_bulk, to_ndjson, BULK_BATCH_SIZE, BULK_LLM_CONCURRENCY
+
+
+def main():
+    """Runs a JSONL file of queries through the RAG pipeline in batches and writes NDJSON results."""
+    parser = argparse.ArgumentParser(description="Bulk query the Thalassa pipeline (evaluation / cache pre-warming).")
+    parser.add_argument("input", help="JSONL file with one {\"query\": ..., \"id\": ..., \"tenant\": ...} per line, or '-' for stdin.")
+    parser.add_argument("-o", "--output", default="-", help="NDJSON output file (default: stdout).")
+    parser.add_argument("--tenant", default=None, help="Default tenant for records without a 'tenant' field.")
+    parser.add_argument("--generate", action="store_true", help="Also generate LLM answers.")
+    parser.add_argument("--concurrency", type=int, default=BULK_LLM_CONCURRENCY, help="Parallel LLM calls when generating.")
+    parser.add_argument("--batch-size", type=int, default=BULK_BATCH_SIZE, help="Queries searched per vectorized batch.")
+    parser.add_argument("--include-context", action="store_true", help="Include the retrieved context in each result.")
+    args = parser.parse_args()
+
+    infile = sys.stdin if args.input == "-" else open(args.input, "r", encoding="utf-8")
+    outfile = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    try:
+        results = run_bulk(parse_jsonl(infile), tenant_id=args.tenant, generate=args.generate,
+                           llm_concurrency=args.concurrency, include_context=args.include_context,
+                           batch_size=args.batch_size)
+        for line in to_ndjson(results):
+            outfile.write(line)
+            outfile.flush()
+    finally:
+        if infile is not sys.stdin:
+            infile.close()
+        if outfile is not sys.stdout:
+            outfile.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,5 @@
 import os
+import sys
 import numpy as np
 import faiss
 from sentence_transformers import SentenceTransformer
@@ -6,6 +7,12 @@ import glob
 from dotenv import load_dotenv
 import logging
 
+# Allow importing the shared app package when run as `python utils/create_faiss_index.py`
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app.chunking import append_chunk_records, CHUNK_OVERLAP
+from app.context_compression import BoilerplateLearner, save_boilerplate, BOILERPLATE_FILE
+from app.ingestion import iter_text_files, iter_file_lines, iter_document_chunks, index_records, INGEST_BATCH_SIZE
+
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -16,7 +23,8 @@ load_dotenv()
 TEXT_FOLDER = os.getenv("TEXT_FOLDER", "extracted_texts")
 INDEX_FILE = os.getenv("INDEX_FILE", "data/faiss_index.bin")
 METADATA_FILE = os.getenv("METADATA_FILE", "data/metadata.npy")
-CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", 200))
+CHUNKS_FILE = os.getenv("CHUNKS_FILE", "data/chunks.jsonl")
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", 256)) # In tokens
 # --- Use Multilingual Model ---
 MODEL_NAME = os.getenv("EMBEDDING_MODEL", "paraphrase-multilingual-mpnet-base-v2")
 # --- End Configuration ---
@@ -24,17 +32,17 @@ MODEL_NAME = os.getenv("EMBEDDING_MODEL", "paraphrase-multilingual-mpnet-base-v2
 # Create data directory if it doesn't exist
 os.makedirs(os.path.dirname(INDEX_FILE), exist_ok=True)
 
-def chunk_text(text, chunk_size=CHUNK_SIZE):
-    """Splits text into smaller chunks by words."""
-    words = text.split()
-    return [" ".join(words[i:i+chunk_size]) for i in range(0, len(words), chunk_size)]
-
-def create_faiss_index(text_folder, index_file, metadata_file, model_name=MODEL_NAME, chunk_size=CHUNK_SIZE):
-    """Extracts text, creates embeddings using the specified model, and saves FAISS index."""
+def create_faiss_index(text_folder, index_file, metadata_file, model_name=MODEL_NAME, chunk_size=CHUNK_SIZE,
+                       chunks_file=CHUNKS_FILE, overlap=CHUNK_OVERLAP, boilerplate_file=BOILERPLATE_FILE,
+                       batch_size=INGEST_BATCH_SIZE):
+    """
+    Streams text files, chunks them lazily, encodes fixed-size batches and appends the vectors to the
+    FAISS index and the chunk store as it goes, so memory stays bounded by the batch size (plus the index).
+    """
     logging.info(f"Starting FAISS index creation process...")
     logging.info(f"--- Using Embedding Model: {model_name} ---") # Highlight model change
     logging.info(f"Text folder: {text_folder}")
-    logging.info(f"Chunk size: {chunk_size} words")
+    logging.info(f"Chunk size: {chunk_size} tokens, overlap: {overlap} tokens, batch size: {batch_size} chunks")
 
     try:
         model = SentenceTransformer(model_name)
@@ -43,69 +51,40 @@ def create_faiss_index(text_folder, index_file, metadata_file, model_name=MODEL_
         logging.error(f"Failed to load SentenceTransformer model '{model_name}': {e}", exc_info=True)
         return
 
-    documents = []
-    metadata = [] # Stores tuples of (filename, chunk_index)
-
     if not os.path.isdir(text_folder):
         logging.error(f"Text folder not found: {text_folder}")
         return
 
-    # Load text files and split into chunks
-    logging.info("Loading and chunking text files...")
-    found_files = False
-    for filename in os.listdir(text_folder):
-        if filename.endswith(".txt"):
-            # Avoid indexing the merged file itself if it exists
-            if filename == 'hepsi.txt':
-                continue
-            found_files = True
-            file_path = os.path.join(text_folder, filename)
-            try:
-                with open(file_path, "r", encoding="utf-8") as f:
-                    text = f.read()
-                    if not text or text.isspace():
-                        logging.warning(f"Skipping empty file: {filename}")
-                        continue
-
-                    text_chunks = chunk_text(text, chunk_size)
-                    logging.info(f"Processed '{filename}': {len(text_chunks)} chunks created.")
-
-                    for i, chunk in enumerate(text_chunks):
-                        documents.append(chunk)
-                        metadata.append((filename, i)) # Store filename and chunk index
-            except Exception as e:
-                logging.error(f"Failed to read or process file {filename}: {e}")
-
-    if not found_files:
+    filenames = list(iter_text_files(text_folder))
+    if not filenames:
         logging.warning(f"No .txt files found in {text_folder} to index.")
         # Consider creating empty index/metadata if needed downstream
         return
 
-    if not documents:
-        logging.error("No documents could be processed into chunks. Aborting index creation.")
-        return
-
-    # Generate embeddings for the text chunks
-    logging.info(f"Generating embeddings for {len(documents)} chunks (this may take time)...")
+    metadata = [] # Stores tuples of (filename, chunk_index)
+    boilerplate_learner = BoilerplateLearner() # Learns repeated header/footer lines
+    # Write the chunk store next to the old one and swap it in at the end, so a running server
+    # never sees a chunk store that disagrees with its index
+    chunks_tmp_file = chunks_file + ".tmp"
+    append_chunk_records(chunks_tmp_file, [], mode="w")
+
+    def on_batch(batch):
+        append_chunk_records(chunks_tmp_file, batch)
+        metadata.extend((record["file"], record["chunk"]) for record in batch)
+
+    # Load, chunk and embed text files as a stream
+    logging.info("Streaming, chunking and embedding text files (this may take time)...")
+    documents = ((filename, iter_file_lines(os.path.join(text_folder, filename))) for filename in filenames)
+    records = iter_document_chunks(documents, chunk_size, overlap, boilerplate_learner)
     try:
-        embeddings = model.encode(documents, convert_to_numpy=True, show_progress_bar=True)
+        index = index_records(records, model, model_name, on_batch=on_batch, batch_size=batch_size)
     except Exception as e:
         logging.error(f"Failed to encode documents: {e}", exc_info=True)
         return
 
-    # Create the FAISS index (using L2 distance)
-    dimension = embeddings.shape[1]
-    # Use IndexFlatIP (Inner Product) which is equivalent to Cosine Similarity for normalized vectors
-    index = faiss.IndexFlatIP(dimension)
-    logging.info(f"Created FAISS index with dimension: {dimension} using IndexFlatIP.")
-
-    # Normalize the embeddings (essential for IndexFlatIP / Cosine Similarity)
-    logging.info("Normalizing embeddings...")
-    faiss.normalize_L2(embeddings)
-
-    # Add embeddings to the index
-    logging.info("Adding embeddings to the index...")
-    index.add(embeddings)
+    if index is None:
+        logging.error("No documents could be processed into chunks. Aborting index creation.")
+        return
     logging.info(f"Successfully added {index.ntotal} vectors to the index.")
 
     # Save the FAISS index to a file
@@ -125,7 +104,24 @@ def create_faiss_index(text_folder, index_file, metadata_file, model_name=MODEL_
     except Exception as e:
         logging.error(f"Failed to save metadata: {e}")
 
+    # Move the chunk store (chunk text + sentence boundaries) used at query time into place
+    logging.info(f"Saving chunk store to {chunks_file}...")
+    try:
+        os.replace(chunks_tmp_file, chunks_file)
+        logging.info("Chunk store saved successfully.")
+    except Exception as e:
+        logging.error(f"Failed to save chunk store: {e}")
+
+    # Save learned boilerplate lines, stripped from the context at query time
+    boilerplate_lines = boilerplate_learner.lines()
+    logging.info(f"Saving {len(boilerplate_lines)} boilerplate lines to {boilerplate_file}...")
+    try:
+        save_boilerplate(boilerplate_lines, boilerplate_file)
+        logging.info("Boilerplate lines saved successfully.")
+    except Exception as e:
+        logging.error(f"Failed to save boilerplate lines: {e}")
+
     logging.info("FAISS index creation process completed.")
 
 if __name__ == "__main__":
-    create_faiss_index(TEXT_FOLDER, INDEX_FILE, METADATA_FILE)
\ No newline at end of file
+    create_faiss_index(TEXT_FOLDER, INDEX_FILE, METADATA_FILE, chunks_file=CHUNKS_FILE)
\ No newline at end of file
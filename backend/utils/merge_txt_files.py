@@ -1,4 +1,5 @@
 import os
+import shutil
 import logging
 
 # Configure logging
@@ -8,9 +9,10 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 TEXT_FOLDER = os.getenv("TEXT_FOLDER", './extracted_texts')
 OUTPUT_FILE_NAME = 'hepsi.txt' # Keep merged file within the text folder
 OUTPUT_FILE_PATH = os.path.join(TEXT_FOLDER, OUTPUT_FILE_NAME)
+COPY_BUFFER_SIZE = 1024 * 1024 # 1 MiB per read
 
 def merge_txt_files(input_folder, output_file):
-    """Merges all .txt files in the input folder into a single output file."""
+    """Merges all .txt files in the input folder into a single output file, streaming each file."""
     logging.info(f"Starting merge process for folder: {input_folder}")
     logging.info(f"Output file: {output_file}")
 
@@ -47,8 +49,8 @@ def merge_txt_files(input_folder, output_file):
                 file_path = os.path.join(input_folder, txt_file)
                 try:
                     with open(file_path, 'r', encoding='utf-8') as infile:
-                        content = infile.read()
-                        outfile.write(content)
+                        # Stream in fixed-size blocks instead of reading whole files into memory
+                        shutil.copyfileobj(infile, outfile, COPY_BUFFER_SIZE)
                         # Add a clear separator between files for potential debugging
                         # Add two newlines for better separation
                         if i < len(txt_files) - 1: